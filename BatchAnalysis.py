@@ -0,0 +1,152 @@
+"""
+headless batch analysis of game archives, no pygame needed
+pgn games are replayed move by move through GameState.make_move, fen/epd files are read one
+position per line. every position gets one json line with some statistics (legal moves, check,
+material, static eval, zobrist key). files are streamed, nothing is loaded as a whole
+several input files (shards) can be processed by parallel worker processes
+
+usage:
+    python BatchAnalysis.py games.pgn --output stats.jsonl
+    python BatchAnalysis.py shard1.pgn shard2.pgn.gz shard3.pgn --workers 3 --output-dir stats/
+    python BatchAnalysis.py positions.fen --format fen
+the summary (games/sec, positions/sec, peak rss) goes to stderr as json
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import resource
+import sys
+import time
+
+import ChessAI
+import ChessEngine
+import PGN
+
+def guess_format(path):
+    name = path[:-3] if path.endswith(".gz") else path
+    return "fen" if name.endswith((".fen", ".epd")) else "pgn"
+
+def position_stats(gs):
+    codes = gs.get_valid_move_codes()
+    material = 0
+    for row in gs.board:
+        for piece in row:
+            if piece != "--":
+                value = ChessAI.piece_value[piece[1]]
+                material += value if piece[0] == "w" else -value
+    score = ChessAI.evaluate(gs)
+    return {"key": "%016x" % gs.zobrist_key, "white_to_move": gs.white_to_move, "legal_moves": len(codes),
+            "in_check": gs.in_check, "checkmate": gs.checkmate, "stalemate": gs.stalemate,
+            "material": material, "eval": score if gs.white_to_move else -score}
+
+def analyse_pgn(stream, out, backend, counts):
+    for index, game in enumerate(PGN.read_games(stream)):
+        counts["games"] += 1
+        try:
+            gs = game.start_position(backend)
+        except (ValueError, KeyError) as e:
+            counts["errors"] += 1
+            out.write(json.dumps({"game": index, "ply": 0, "error": str(e)}) + "\n")
+            continue
+        record = {"game": index, "ply": 0, "san": None}
+        record.update(position_stats(gs))
+        out.write(json.dumps(record) + "\n")
+        counts["positions"] += 1
+        for ply, san in enumerate(game.moves, 1):
+            try:
+                move = PGN.resolve_san(gs, san)
+            except ValueError as e: #the rest of this game cannot be replayed
+                counts["errors"] += 1
+                out.write(json.dumps({"game": index, "ply": ply, "san": san, "error": str(e)}) + "\n")
+                break
+            gs.make_move(move)
+            record = {"game": index, "ply": ply, "san": san}
+            record.update(position_stats(gs))
+            out.write(json.dumps(record) + "\n")
+            counts["positions"] += 1
+
+def analyse_fen(stream, out, backend, counts):
+    for index, fen in enumerate(PGN.read_fens(stream)):
+        try:
+            gs = ChessEngine.GameState(backend)
+            gs.set_fen(fen)
+        except (ValueError, KeyError) as e:
+            counts["errors"] += 1
+            out.write(json.dumps({"position": index, "fen": fen, "error": str(e)}) + "\n")
+            continue
+        record = {"position": index, "fen": fen}
+        record.update(position_stats(gs))
+        out.write(json.dumps(record) + "\n")
+        counts["positions"] += 1
+
+def analyse_file(path, output, file_format=None, backend="board"):
+    #processes one shard, output is a path or "-" for stdout, returns the summary of the shard
+    counts = {"games": 0, "positions": 0, "errors": 0}
+    start = time.perf_counter()
+    stream = PGN.open_text(path)
+    out = sys.stdout if output == "-" else open(output, "w")
+    try:
+        if (file_format or guess_format(path)) == "fen":
+            analyse_fen(stream, out, backend, counts)
+        else:
+            analyse_pgn(stream, out, backend, counts)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        if out is not sys.stdout:
+            out.close()
+    seconds = time.perf_counter() - start
+    summary = {"input": path, "output": output, "seconds": round(seconds, 3),
+               "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    summary.update(counts)
+    summary["games_per_sec"] = round(counts["games"] / seconds, 2) if seconds > 0 else None
+    summary["positions_per_sec"] = round(counts["positions"] / seconds, 2) if seconds > 0 else None
+    return summary
+
+def shard_output(path, output_dir):
+    name = os.path.basename(path)
+    if name.endswith(".gz"):
+        name = name[:-3]
+    return os.path.join(output_dir, os.path.splitext(name)[0] + ".jsonl")
+
+def run(inputs, output="-", output_dir=None, workers=1, file_format=None, backend="board"):
+    start = time.perf_counter()
+    if len(inputs) == 1 and output_dir is None:
+        shards = [analyse_file(inputs[0], output, file_format, backend)]
+    else:
+        output_dir = output_dir or "."
+        os.makedirs(output_dir, exist_ok=True)
+        outputs = [shard_output(path, output_dir) for path in inputs]
+        if workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+                shards = list(pool.map(analyse_file, inputs, outputs, [file_format] * len(inputs),
+                                       [backend] * len(inputs)))
+        else:
+            shards = [analyse_file(path, out, file_format, backend) for path, out in zip(inputs, outputs)]
+    seconds = time.perf_counter() - start
+    games = sum(s["games"] for s in shards)
+    positions = sum(s["positions"] for s in shards)
+    return {"shards": shards, "workers": workers, "games": games, "positions": positions,
+            "errors": sum(s["errors"] for s in shards), "seconds": round(seconds, 3),
+            "games_per_sec": round(games / seconds, 2) if seconds > 0 else None,
+            "positions_per_sec": round(positions / seconds, 2) if seconds > 0 else None,
+            "peak_rss_kb": max(s["peak_rss_kb"] for s in shards)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="replay pgn/fen archives and write per position stats as jsonl")
+    parser.add_argument("inputs", nargs="+", help="pgn or fen files (.gz ok), - for stdin")
+    parser.add_argument("--format", choices=["pgn", "fen"], default=None, help="default: from the file name")
+    parser.add_argument("--output", default="-", help="jsonl file for a single input, default stdout")
+    parser.add_argument("--output-dir", default=None, help="one <shard>.jsonl per input goes here")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes, one shard each at a time")
+    parser.add_argument("--backend", default="board", choices=["board", "bitboard"])
+    args = parser.parse_args(argv)
+    summary = run(args.inputs, args.output, args.output_dir, args.workers, args.format, args.backend)
+    json.dump(summary, sys.stderr, indent=2)
+    sys.stderr.write("\n")
+    return 0 if summary["errors"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
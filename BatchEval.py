@@ -0,0 +1,187 @@
+"""
+batch evaluation with numpy: N positions become one (N, 12, 8, 8) array of piece planes
+(plane order is Bitboard.pieces: wp wN wB wR wQ wK bp bN bB bR bQ bK, square [r][c] like GameState.board)
+and the material + piece square evaluation of ChessAI.evaluate is one matrix product over the whole batch
+positions come from GameState objects (through their bitboards) or straight from the 32 byte records
+of PositionFile, a memory mapped position file is read in chunks without decoding a single board in python
+needs numpy (only this module does)
+
+usage:
+    python BatchEval.py --bench 20000
+    python BatchEval.py --positions positions.pos --out scores.npy --mobility
+"""
+
+import argparse
+import json
+import operator
+import random
+import sys
+import time
+
+import numpy as np
+
+import Bitboard
+import ChessAI
+import ChessEngine
+import PositionFile
+
+#material + square value per plane, white positive, same numbers as ChessAI.square_score
+#float32 so the evaluation is one blas matrix-vector product, every sum stays far below 2**24 so it is exact
+weights = np.array([ChessAI.square_score[piece] for piece in Bitboard.pieces], dtype=np.float32).reshape(768)
+get_bitboards = operator.itemgetter(*Bitboard.pieces)
+plane_codes = np.arange(1, 13, dtype=np.uint8).reshape(1, 12, 1) #PositionFile nibble code of every plane
+
+def planes_from_states(states): #list of GameState -> (planes uint8 (N, 12, 8, 8), white_to_move bool (N,))
+    bitboards = np.fromiter((bb for gs in states for bb in get_bitboards(gs.bitboards.pieces)),
+                            dtype="<u8", count=12 * len(states))
+    #bit sq of a bitboard is square sq, so the little endian bytes unpacked little endian are the 64 squares in order
+    planes = np.unpackbits(bitboards.view(np.uint8).reshape(-1, 12, 8), axis=2, bitorder="little")
+    white_to_move = np.array([gs.white_to_move for gs in states], dtype=bool)
+    return planes.reshape(-1, 12, 8, 8), white_to_move
+
+def planes_from_records(data): #N*32 bytes of PositionFile records (bytes, mmap, memoryview) -> same as above
+    records = np.frombuffer(data, dtype=np.uint8).reshape(-1, PositionFile.record_size)
+    codes = np.empty((len(records), 64), dtype=np.uint8)
+    codes[:, 0::2] = records >> 4
+    codes[:, 1::2] = records & 15
+    black_king_to_move = codes == PositionFile.black_king_to_move
+    white_to_move = ~black_king_to_move.any(axis=1)
+    codes[black_king_to_move] = PositionFile.piece_to_code["bK"]
+    #castling rooks are on rank 8 (black) or rank 1 (white), an en passant pawn belongs to the side not to move
+    rook = codes == PositionFile.castling_rook
+    codes[:, :32][rook[:, :32]] = PositionFile.piece_to_code["bR"]
+    codes[:, 32:][rook[:, 32:]] = PositionFile.piece_to_code["wR"]
+    pawn_records, pawn_squares = (codes == PositionFile.en_passant_pawn).nonzero()
+    codes[pawn_records, pawn_squares] = np.where(white_to_move[pawn_records], PositionFile.piece_to_code["bp"],
+                                                 PositionFile.piece_to_code["wp"])
+    planes = (codes[:, None, :] == plane_codes).astype(np.uint8)
+    return planes.reshape(-1, 12, 8, 8), white_to_move
+
+def evaluate_batch(planes, white_to_move): #ChessAI.evaluate for every position, side to move point of view
+    white_score = (planes.reshape(-1, 768).astype(np.float32) @ weights).astype(np.int32)
+    return np.where(white_to_move, white_score, -white_score)
+
+def shift(squares, dr, dc): #(N, 8, 8) bool moved by dr rows and dc cols, what falls off the board is gone
+    moved = np.zeros_like(squares)
+    moved[:, max(dr, 0):8 + min(dr, 0), max(dc, 0):8 + min(dc, 0)] = \
+        squares[:, max(-dr, 0):8 + min(-dr, 0), max(-dc, 0):8 + min(-dc, 0)]
+    return moved
+
+def count_steps(pieces, directions, own, sliding, empty):
+    count = np.zeros(len(pieces), dtype=np.int32)
+    for dr, dc in directions:
+        ray = pieces
+        for step in range(7 if sliding else 1):
+            ray = shift(ray, dr, dc)
+            count += (ray & ~own).sum(axis=(1, 2))
+            ray = ray & empty
+            if not ray.any():
+                break
+    return count
+
+def mobility_batch(planes):
+    #pseudo legal move count of knights, bishops, rooks, queens and king per side, (N, 2) for white, black
+    #pins and checks are ignored, like a mobility term in an evaluation
+    occupied = planes.astype(bool)
+    white = occupied[:, :6].any(axis=1)
+    black = occupied[:, 6:].any(axis=1)
+    empty = ~(white | black)
+    result = np.zeros((len(planes), 2), dtype=np.int32)
+    for side, (offset, own) in enumerate(((0, white), (6, black))):
+        result[:, side] += count_steps(occupied[:, offset + 1], Bitboard.knight_directions, own, False, empty)
+        result[:, side] += count_steps(occupied[:, offset + 2] | occupied[:, offset + 4], Bitboard.bishop_directions,
+                                       own, True, empty)
+        result[:, side] += count_steps(occupied[:, offset + 3] | occupied[:, offset + 4], Bitboard.rook_directions,
+                                       own, True, empty)
+        result[:, side] += count_steps(occupied[:, offset + 5], Bitboard.king_directions, own, False, empty)
+    return result
+
+def evaluate_file(path, chunk=1 << 16, mobility=False):
+    #scores of every position in a position file, chunk positions at a time so memory stays flat
+    scores = []
+    moves = []
+    with PositionFile.PositionFile(path) as positions:
+        for start in range(0, len(positions), chunk):
+            end = min(start + chunk, len(positions))
+            data = positions.view[start * PositionFile.record_size:end * PositionFile.record_size]
+            planes, white_to_move = planes_from_records(data)
+            scores.append(evaluate_batch(planes, white_to_move))
+            if mobility:
+                moves.append(mobility_batch(planes))
+            del data
+    scores = np.concatenate(scores) if scores else np.zeros(0, dtype=np.int32)
+    if mobility:
+        return scores, (np.concatenate(moves) if moves else np.zeros((0, 2), dtype=np.int32))
+    return scores, None
+
+def random_positions(count, seed=1, max_plies=60): #positions along random games, for the benchmark
+    rng = random.Random(seed)
+    states = []
+    while len(states) < count:
+        gs = ChessEngine.GameState("bitboard")
+        for ply in range(max_plies):
+            codes = gs.get_valid_move_codes()
+            if not codes or len(states) >= count:
+                break
+            gs.make_move_code(rng.choice(codes))
+            copy = ChessEngine.GameState("bitboard")
+            copy.set_position(gs.board, gs.white_to_move, gs.castling, gs.en_passant, gs.halfmove)
+            states.append(copy)
+    return states
+
+def bench(count, seed=1):
+    states = random_positions(count, seed)
+    records = b"".join(PositionFile.encode_state(gs) for gs in states)
+    report = {"positions": count}
+
+    t = time.perf_counter()
+    loop_scores = [ChessAI.evaluate(gs) for gs in states]
+    loop = time.perf_counter() - t
+    t = time.perf_counter()
+    planes, white_to_move = planes_from_states(states)
+    state_scores = evaluate_batch(planes, white_to_move)
+    from_states = time.perf_counter() - t
+    t = time.perf_counter()
+    planes, white_to_move = planes_from_records(records)
+    record_scores = evaluate_batch(planes, white_to_move)
+    from_records = time.perf_counter() - t
+    t = time.perf_counter()
+    mobility = mobility_batch(planes)
+    mobility_seconds = time.perf_counter() - t
+
+    report["same_scores"] = loop_scores == state_scores.tolist() == record_scores.tolist()
+    for name, seconds in (("per_position", loop), ("batch_from_states", from_states),
+                          ("batch_from_records", from_records), ("batch_mobility", mobility_seconds)):
+        report[name] = {"seconds": round(seconds, 4), "positions_per_sec": int(count / seconds) if seconds > 0 else None}
+    report["speedup_from_records"] = round(loop / from_records, 2) if from_records > 0 else None
+    report["mean_mobility"] = [round(float(m), 2) for m in mobility.mean(axis=0)]
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="numpy batch evaluation of positions")
+    parser.add_argument("--bench", type=int, default=0, help="compare per position and batched eval on N positions")
+    parser.add_argument("--positions", default=None, help="position file from PositionFile.py")
+    parser.add_argument("--out", default=None, help="write the scores (and mobility) to this .npy file")
+    parser.add_argument("--mobility", action="store_true", help="also count moves per side")
+    parser.add_argument("--chunk", type=int, default=1 << 16)
+    args = parser.parse_args(argv)
+    if args.bench:
+        report = bench(args.bench)
+    elif args.positions:
+        t = time.perf_counter()
+        scores, mobility = evaluate_file(args.positions, args.chunk, args.mobility)
+        seconds = time.perf_counter() - t
+        if args.out:
+            np.save(args.out, scores if mobility is None else np.column_stack([scores, mobility]))
+        report = {"positions": len(scores), "seconds": round(seconds, 4),
+                  "positions_per_sec": int(len(scores) / seconds) if seconds > 0 else None,
+                  "mean_eval": round(float(scores.mean()), 2) if len(scores) else None}
+    else:
+        parser.print_help()
+        return 0
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,522 @@
+"""
+bitboard backend for GameState
+every piece type of every color is kept as a 64 bit int, bit number row*8 + col is set
+when that piece stands on the square (row 0 is rank 8, same layout as GameState.board)
+also responsible for generating the valid moves straight from the bitboards
+"""
+
+full = 0xFFFFFFFFFFFFFFFF
+file_a = 0x0101010101010101 #col 0
+file_h = file_a << 7 #col 7
+row_2 = 0xFF << 40 #row 5 (rank 3), white pawns land here after one push from the start row
+row_5 = 0xFF << 16 #row 2 (rank 6), same thing for black
+last_rows = 0xFF | 0xFF << 56 #rank 8 and rank 1, a pawn landing here promotes
+
+pieces = ["wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK"]
+
+#a move code is start_sq << 6 | end_sq, bits 12-15 are a flag for the special moves
+flag_en_passant = 1
+flag_castle = 2
+flag_promotion = 4 #4-7, the piece is promotion_pieces[flag & 3]
+promotion_pieces = "NBRQ"
+promotion_flags = (7, 6, 5, 4) #queen first, the search tries them in this order
+
+#castling rights, one bit each (0-15, GameState.castling)
+castle_white_king = 1
+castle_white_queen = 2
+castle_black_king = 4
+castle_black_queen = 8
+#square -> rights left when a move starts or ends there (king or rook moved, rook taken)
+castle_mask = [15] * 64
+castle_mask[60] = 15 & ~(castle_white_king | castle_white_queen) #e1
+castle_mask[63] = 15 & ~castle_white_king #h1
+castle_mask[56] = 15 & ~castle_white_queen #a1
+castle_mask[4] = 15 & ~(castle_black_king | castle_black_queen) #e8
+castle_mask[7] = 15 & ~castle_black_king #h8
+castle_mask[0] = 15 & ~castle_black_queen #a8
+color_rights = {"w": castle_white_king | castle_white_queen, "b": castle_black_king | castle_black_queen}
+#king target square -> (rook start square, rook end square)
+castle_rooks = {62: (63, 61), 58: (56, 59), 6: (7, 5), 2: (0, 3)}
+#per color: (right, king square, king target, squares that have to be empty, squares the king crosses)
+castle_paths = {"w": ((castle_white_king, 60, 62, 3 << 61, (61, 62)),
+                      (castle_white_queen, 60, 58, 7 << 57, (59, 58))),
+                "b": ((castle_black_king, 4, 6, 3 << 5, (5, 6)),
+                      (castle_black_queen, 4, 2, 7 << 1, (3, 2)))}
+no_en_passant = 64 #GameState.en_passant when no pawn can be taken en passant
+
+#lookup tables, indexed by square
+#filled in place by init_tables on the first BitboardBoard, not at import, so importing costs nothing
+tables_ready = False
+knight_attacks = []
+king_attacks = []
+pawn_attacks = {"w": [], "b": []} #squares a pawn of that color on the square attacks
+between = [] #between[a][b] squares strictly between a and b if they share a line, else 0
+line = [] #line[a][b] the whole line through a and b if they share one, else 0
+
+#sliding pieces: for every square and every line type (file, rank, diagonal, anti diagonal)
+#we keep the mask of the inner squares of that line and a dict occupancy -> attacks
+#so a rook is two dict lookups and a bishop is two dict lookups
+line_masks = []
+line_attacks = []
+
+rook_directions = ((-1, 0), (1, 0), (0, -1), (0, 1))
+bishop_directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+knight_directions = ((-2, 1), (-1, 2), (1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1))
+king_directions = ((-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1))
+#each line type is walked in both directions
+line_types = (((-1, 0), (1, 0)), ((0, -1), (0, 1)), ((-1, -1), (1, 1)), ((-1, 1), (1, -1)))
+
+def square(r, c):
+    return r*8 + c
+
+def ray_attacks(sq, dirs, occ): #slow ray walk, only used to fill the tables
+    attacks = 0
+    r0, c0 = divmod(sq, 8)
+    for d in dirs:
+        for i in range(1, 8):
+            r = r0 + d[0]*i
+            c = c0 + d[1]*i
+            if not (0 <= r < 8 and 0 <= c < 8):
+                break
+            attacks |= 1 << square(r, c)
+            if occ & (1 << square(r, c)):
+                break
+    return attacks
+
+def inner_mask(sq, dirs): #squares on the rays but without the last square before the edge
+    mask = 0
+    r0, c0 = divmod(sq, 8)
+    for d in dirs:
+        for i in range(1, 7):
+            r = r0 + d[0]*(i+1)
+            c = c0 + d[1]*(i+1)
+            if not (0 <= r < 8 and 0 <= c < 8):
+                break
+            mask |= 1 << square(r0 + d[0]*i, c0 + d[1]*i)
+    return mask
+
+def step_table(directions):
+    table = []
+    for sq in range(64):
+        r0, c0 = divmod(sq, 8)
+        bb = 0
+        for d in directions:
+            r = r0 + d[0]
+            c = c0 + d[1]
+            if 0 <= r < 8 and 0 <= c < 8:
+                bb |= 1 << square(r, c)
+        table.append(bb)
+    return table
+
+def init_tables(): #once per process, the lists above keep their identity so every reference to them stays valid
+    global tables_ready
+    if tables_ready:
+        return
+    tables_ready = True
+    knight_attacks.extend(step_table(knight_directions))
+    king_attacks.extend(step_table(king_directions))
+    pawn_attacks["w"].extend(step_table(((-1, -1), (-1, 1))))
+    pawn_attacks["b"].extend(step_table(((1, -1), (1, 1))))
+    for sq in range(64):
+        masks = []
+        tables = []
+        for dirs in line_types:
+            mask = inner_mask(sq, dirs)
+            table = {}
+            sub = 0
+            while True: #walk every subset of the mask (carry rippler)
+                table[sub] = ray_attacks(sq, dirs, sub)
+                sub = (sub - mask) & mask
+                if sub == 0:
+                    break
+            masks.append(mask)
+            tables.append(table)
+        line_masks.append(tuple(masks))
+        line_attacks.append(tuple(tables))
+    for a in range(64):
+        between_row = []
+        line_row = []
+        ra, ca = divmod(a, 8)
+        for b in range(64):
+            rb, cb = divmod(b, 8)
+            dr = rb - ra
+            dc = cb - ca
+            if a != b and (dr == 0 or dc == 0 or abs(dr) == abs(dc)):
+                d = ((dr > 0) - (dr < 0), (dc > 0) - (dc < 0))
+                between_row.append(ray_attacks(a, (d,), 1 << b) & ~(1 << b))
+                line_row.append(ray_attacks(a, (d, (-d[0], -d[1])), 0) | (1 << a))
+            else:
+                between_row.append(0)
+                line_row.append(0)
+        between.append(between_row)
+        line.append(line_row)
+
+def rook_attacks(sq, occ):
+    masks = line_masks[sq]
+    tables = line_attacks[sq]
+    return tables[0][occ & masks[0]] | tables[1][occ & masks[1]]
+
+def bishop_attacks(sq, occ):
+    masks = line_masks[sq]
+    tables = line_attacks[sq]
+    return tables[2][occ & masks[2]] | tables[3][occ & masks[3]]
+
+def pawn_attack_set(color, pawns): #every square attacked by all the pawns of one color at once
+    if color == "w":
+        return ((pawns >> 7) & ~file_a) | ((pawns >> 9) & ~file_h)
+    return (((pawns << 9) & ~file_a) | ((pawns << 7) & ~file_h)) & full
+
+class AttackInfo():
+    #everything about checks and pins of one position, computed once (BitboardBoard.attack_info)
+    #and then answered with bit tests: is_attacked, pin_line, in_check
+    __slots__ = ("king_square", "checkers", "check_mask", "pinned", "pin_lines", "in_check",
+                 "attacked", "bitboards", "enemy")
+
+    def __init__(self, king_square, checkers, check_mask, pinned, pin_lines, bitboards, enemy):
+        self.king_square = king_square
+        self.checkers = checkers #enemy pieces giving check
+        self.check_mask = check_mask #squares a non king move has to land on (full if no check, 0 if double check)
+        self.pinned = pinned #our pinned pieces
+        self.pin_lines = pin_lines #pinned square -> line it may still move on
+        self.in_check = checkers != 0
+        #squares the enemy attacks (looking through our king), only built the first time someone asks
+        self.attacked = None
+        self.bitboards = bitboards
+        self.enemy = enemy
+
+    def get_attacked(self):
+        if self.attacked is None:
+            bb = self.bitboards
+            king = 1 << self.king_square
+            self.attacked = bb.attacked_squares(self.enemy, bb.occupied ^ king)
+            self.bitboards = None #the map is done, the bitboards will move on
+        return self.attacked
+
+    def is_attacked(self, sq):
+        return (self.get_attacked() >> sq) & 1 == 1
+
+    def pin_line(self, sq): #None if the piece on sq is not pinned
+        return self.pin_lines.get(sq)
+
+class BitboardBoard():
+    def __init__(self, board):
+        if not tables_ready:
+            init_tables()
+        self.pieces = {p: 0 for p in pieces}
+        self.colors = {"w": 0, "b": 0}
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c]
+                if piece != "--":
+                    bit = 1 << square(r, c)
+                    self.pieces[piece] |= bit
+                    self.colors[piece[0]] |= bit
+        self.occupied = self.colors["w"] | self.colors["b"]
+
+    def make_move(self, move):
+        if move.move_ID >> 12:
+            self.make_special_move(move)
+            return
+        start = 1 << (move.start_row*8 + move.start_col)
+        end = 1 << (move.end_row*8 + move.end_col)
+        moved = move.piece_moved
+        self.pieces[moved] ^= start | end
+        self.colors[moved[0]] ^= start | end
+        if move.piece_capt != "--":
+            self.pieces[move.piece_capt] ^= end
+            self.colors[move.piece_capt[0]] ^= end
+        self.occupied = self.colors["w"] | self.colors["b"]
+
+    def make_special_move(self, move): #promotion, en passant and castling, kept out of the common path
+        start = 1 << (move.start_row*8 + move.start_col)
+        end_sq = move.end_row*8 + move.end_col
+        end = 1 << end_sq
+        moved = move.piece_moved
+        flag = move.move_ID >> 12
+        p = self.pieces
+        colors = self.colors
+        if flag & flag_promotion: #the pawn leaves, the new piece arrives
+            p[moved] ^= start
+            p[moved[0] + promotion_pieces[flag & 3]] ^= end
+        else:
+            p[moved] ^= start | end
+        colors[moved[0]] ^= start | end
+        captured = move.piece_capt
+        if captured != "--":
+            if flag == flag_en_passant: #the pawn taken is next to the start square, not on the end square
+                end = 1 << (move.start_row*8 + move.end_col)
+            p[captured] ^= end
+            colors[captured[0]] ^= end
+        elif flag == flag_castle:
+            rook_start, rook_end = castle_rooks[end_sq]
+            rook = (1 << rook_start) | (1 << rook_end)
+            p[moved[0] + "R"] ^= rook
+            colors[moved[0]] ^= rook
+        self.occupied = colors["w"] | colors["b"]
+
+    def undo_move(self, move): #xor is its own inverse
+        self.make_move(move)
+
+    def attacked_squares(self, color, occ): #every square attacked by the pieces of color, given occupancy occ
+        p = self.pieces
+        attacked = pawn_attack_set(color, p[color + "p"]) | king_attacks[p[color + "K"].bit_length() - 1]
+        bb = p[color + "N"]
+        while bb:
+            b = bb & -bb
+            attacked |= knight_attacks[b.bit_length() - 1]
+            bb ^= b
+        queens = p[color + "Q"]
+        bb = p[color + "B"] | queens
+        while bb:
+            b = bb & -bb
+            sq = b.bit_length() - 1
+            bb ^= b
+            masks = line_masks[sq]
+            tables = line_attacks[sq]
+            attacked |= tables[2][occ & masks[2]] | tables[3][occ & masks[3]]
+        bb = p[color + "R"] | queens
+        while bb:
+            b = bb & -bb
+            sq = b.bit_length() - 1
+            bb ^= b
+            masks = line_masks[sq]
+            tables = line_attacks[sq]
+            attacked |= tables[0][occ & masks[0]] | tables[1][occ & masks[1]]
+        return attacked
+
+    def attackers_to(self, sq, color, occ): #pieces of color attacking sq
+        p = self.pieces
+        enemy = "b" if color == "w" else "w"
+        return (pawn_attacks[enemy][sq] & p[color + "p"]) | \
+               (knight_attacks[sq] & p[color + "N"]) | \
+               (king_attacks[sq] & p[color + "K"]) | \
+               (bishop_attacks(sq, occ) & (p[color + "B"] | p[color + "Q"])) | \
+               (rook_attacks(sq, occ) & (p[color + "R"] | p[color + "Q"]))
+
+    def attack_info(self, white_to_move): #checks, pins and enemy attacks for the side to move, see AttackInfo
+        if white_to_move:
+            ally, enemy = "w", "b"
+        else:
+            ally, enemy = "b", "w"
+        p = self.pieces
+        own = self.colors[ally]
+        their = self.colors[enemy]
+        occ = self.occupied
+        king = p[ally + "K"]
+        ksq = king.bit_length() - 1
+        enemy_diag = p[enemy + "B"] | p[enemy + "Q"]
+        enemy_line = p[enemy + "R"] | p[enemy + "Q"]
+
+        masks = line_masks[ksq]
+        tables = line_attacks[ksq]
+        checkers = (pawn_attacks[ally][ksq] & p[enemy + "p"]) | (knight_attacks[ksq] & p[enemy + "N"]) | \
+                   ((tables[2][occ & masks[2]] | tables[3][occ & masks[3]]) & enemy_diag) | \
+                   ((tables[0][occ & masks[0]] | tables[1][occ & masks[1]]) & enemy_line)
+        if checkers and not (checkers & (checkers - 1)):
+            check_mask = between[ksq][checkers.bit_length() - 1] | checkers
+        elif checkers: #double check, only the king can move
+            check_mask = 0
+        else:
+            check_mask = full
+
+        #pins: enemy sliders that would see the king if only enemy pieces were on the board
+        pinned = 0
+        pin_lines = {}
+        snipers = ((tables[2][their & masks[2]] | tables[3][their & masks[3]]) & enemy_diag) | \
+                  ((tables[0][their & masks[0]] | tables[1][their & masks[1]]) & enemy_line)
+        between_king = between[ksq]
+        while snipers:
+            b = snipers & -snipers
+            ssq = b.bit_length() - 1
+            snipers ^= b
+            blockers = between_king[ssq] & occ
+            if blockers & own and not (blockers & (blockers - 1)):
+                pinned |= blockers
+                pin_lines[blockers.bit_length() - 1] = line[ksq][ssq]
+        return AttackInfo(ksq, checkers, check_mask, pinned, pin_lines, self, enemy)
+
+    def en_passant_moves(self, white_to_move, en_passant, moves):
+        #appends the legal en passant captures onto square en_passant (no_en_passant: none)
+        #rare, so every one is tested the slow way: take both pawns off and look at the king again,
+        #that covers pins, checks and the two pawns leaving the king's rank at once
+        if en_passant == no_en_passant:
+            return
+        if white_to_move:
+            ally, enemy = "w", "b"
+            captured = en_passant + 8
+        else:
+            ally, enemy = "b", "w"
+            captured = en_passant - 8
+        p = self.pieces
+        ksq = p[ally + "K"].bit_length() - 1
+        enemy_pawns = p[enemy + "p"] ^ (1 << captured)
+        enemy_diag = p[enemy + "B"] | p[enemy + "Q"]
+        enemy_line = p[enemy + "R"] | p[enemy + "Q"]
+        attackers = pawn_attacks[enemy][en_passant] & p[ally + "p"]
+        while attackers:
+            b = attackers & -attackers
+            attackers ^= b
+            occ = (self.occupied ^ b ^ (1 << captured)) | (1 << en_passant)
+            if pawn_attacks[ally][ksq] & enemy_pawns or knight_attacks[ksq] & p[enemy + "N"] or \
+                    bishop_attacks(ksq, occ) & enemy_diag or rook_attacks(ksq, occ) & enemy_line:
+                continue
+            moves.append(flag_en_passant << 12 | (b.bit_length() - 1) << 6 | en_passant)
+
+    def castle_moves(self, white_to_move, castling, moves):
+        #appends the legal castling moves, the caller makes sure the king is not in check
+        occ = self.occupied
+        for right, king, target, empty, crossed in castle_paths["w" if white_to_move else "b"]:
+            if castling & right and not occ & empty:
+                enemy = "b" if white_to_move else "w"
+                if not any(self.attackers_to(sq, enemy, occ) for sq in crossed):
+                    moves.append(flag_castle << 12 | king << 6 | target)
+
+    def get_valid_move(self, white_to_move, moves, info=None, castling=0, en_passant=no_en_passant):
+        #appends every legal move as start_sq << 6 | end_sq (plus the flag bits) to moves, returns whether
+        #the side to move is in check
+        #same algo as GameState.get_valid_move: find checks and pins first, then only generate what is legal
+        if info is None:
+            info = self.attack_info(white_to_move)
+        if white_to_move:
+            ally, enemy = "w", "b"
+        else:
+            ally, enemy = "b", "w"
+        p = self.pieces
+        own = self.colors[ally]
+        their = self.colors[enemy]
+        occ = self.occupied
+        ksq = info.king_square
+        check_mask = info.check_mask
+        pinned = info.pinned
+        pin_lines = info.pin_lines
+
+        #king moves, every target square is tested on its own (usually only a few of them)
+        #the king is taken off the board so it cannot hide behind its own square
+        ally_pawn_table = pawn_attacks[ally]
+        enemy_pawns = p[enemy + "p"]
+        enemy_knights = p[enemy + "N"]
+        enemy_king = p[enemy + "K"]
+        enemy_diag = p[enemy + "B"] | p[enemy + "Q"]
+        enemy_line = p[enemy + "R"] | p[enemy + "Q"]
+        occ_no_king = occ ^ (1 << ksq)
+        targets = king_attacks[ksq] & ~own
+        while targets:
+            b = targets & -targets
+            sq = b.bit_length() - 1
+            targets ^= b
+            masks = line_masks[sq]
+            tables = line_attacks[sq]
+            if ally_pawn_table[sq] & enemy_pawns or knight_attacks[sq] & enemy_knights or \
+                    king_attacks[sq] & enemy_king or \
+                    (tables[2][occ_no_king & masks[2]] | tables[3][occ_no_king & masks[3]]) & enemy_diag or \
+                    (tables[0][occ_no_king & masks[0]] | tables[1][occ_no_king & masks[1]]) & enemy_line:
+                continue
+            moves.append(ksq << 6 | sq)
+        if not check_mask: #double check
+            return True
+        if castling & color_rights[ally] and not info.checkers:
+            self.castle_moves(white_to_move, castling, moves)
+        if en_passant != no_en_passant:
+            self.en_passant_moves(white_to_move, en_passant, moves)
+
+        empty = ~occ & full
+        target_mask = ~own & check_mask
+
+        #pawns, pushes are done for all pawns at once
+        bb = p[ally + "p"]
+        if white_to_move:
+            single = (bb >> 8) & empty
+            double = ((single & row_2) >> 8) & empty
+            step = 8
+        else:
+            single = (bb << 8) & empty
+            double = ((single & row_5) << 8) & empty
+            step = -8
+        single &= check_mask
+        double &= check_mask
+        promote = single & last_rows
+        single ^= promote
+        while single:
+            t = single & -single
+            sq = t.bit_length() - 1
+            single ^= t
+            if not ((1 << (sq + step)) & pinned) or (pin_lines[sq + step] >> sq) & 1:
+                moves.append((sq + step) << 6 | sq)
+        while promote:
+            t = promote & -promote
+            sq = t.bit_length() - 1
+            promote ^= t
+            if not ((1 << (sq + step)) & pinned) or (pin_lines[sq + step] >> sq) & 1:
+                for flag in promotion_flags:
+                    moves.append(flag << 12 | (sq + step) << 6 | sq)
+        while double:
+            t = double & -double
+            sq = t.bit_length() - 1
+            double ^= t
+            start = sq + step + step
+            if not ((1 << start) & pinned) or (pin_lines[start] >> sq) & 1:
+                moves.append(start << 6 | sq)
+        capturable = their & check_mask
+        if white_to_move: #only look at pawns that have something to capture
+            bb &= capturable << 7 | capturable << 9
+        else:
+            bb &= capturable >> 7 | capturable >> 9
+        while bb:
+            b = bb & -bb
+            sq = b.bit_length() - 1
+            bb ^= b
+            targets = ally_pawn_table[sq] & their & check_mask
+            if b & pinned:
+                targets &= pin_lines[sq]
+            while targets:
+                t = targets & -targets
+                if t & last_rows:
+                    for flag in promotion_flags:
+                        moves.append(flag << 12 | sq << 6 | (t.bit_length() - 1))
+                else:
+                    moves.append(sq << 6 | (t.bit_length() - 1))
+                targets ^= t
+
+        #knights, a pinned knight can never move
+        bb = p[ally + "N"] & ~pinned
+        while bb:
+            b = bb & -bb
+            sq = b.bit_length() - 1
+            bb ^= b
+            targets = knight_attacks[sq] & target_mask
+            while targets:
+                t = targets & -targets
+                moves.append(sq << 6 | (t.bit_length() - 1))
+                targets ^= t
+
+        #sliders, queens go through both loops
+        queens = p[ally + "Q"]
+        bb = p[ally + "B"] | queens
+        while bb:
+            b = bb & -bb
+            sq = b.bit_length() - 1
+            bb ^= b
+            masks = line_masks[sq]
+            tables = line_attacks[sq]
+            targets = (tables[2][occ & masks[2]] | tables[3][occ & masks[3]]) & target_mask
+            if b & pinned:
+                targets &= pin_lines[sq]
+            while targets:
+                t = targets & -targets
+                moves.append(sq << 6 | (t.bit_length() - 1))
+                targets ^= t
+        bb = p[ally + "R"] | queens
+        while bb:
+            b = bb & -bb
+            sq = b.bit_length() - 1
+            bb ^= b
+            masks = line_masks[sq]
+            tables = line_attacks[sq]
+            targets = (tables[0][occ & masks[0]] | tables[1][occ & masks[1]]) & target_mask
+            if b & pinned:
+                targets &= pin_lines[sq]
+            while targets:
+                t = targets & -targets
+                moves.append(sq << 6 | (t.bit_length() - 1))
+                targets ^= t
+        return info.in_check
@@ -0,0 +1,448 @@
+"""
+ai player: negamax alpha-beta search on top of GameState.get_valid_move/make_move/undo_move
+iterative deepening until the time budget runs out, a fixed size transposition table keyed
+by GameState.zobrist_key, and move ordering (tt move, mvv-lva captures, killers, history)
+every search reports nodes, depth reached, nodes/sec and tt hit rate
+
+usage:
+    python ChessAI.py --time 1.0
+    python ChessAI.py --fen "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10" --depth 4
+    python ChessAI.py --book book.bin --tables tables #book moves and KQK/KRK tables before searching
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import ChessEngine
+
+piece_value = {"p": 100, "N": 320, "B": 330, "R": 500, "Q": 900, "K": 0}
+
+#piece square tables from white's point of view, row 0 is rank 8 like GameState.board
+#black uses the same tables upside down
+piece_square = {
+    "p": [[0, 0, 0, 0, 0, 0, 0, 0],
+          [50, 50, 50, 50, 50, 50, 50, 50],
+          [10, 10, 20, 30, 30, 20, 10, 10],
+          [5, 5, 10, 25, 25, 10, 5, 5],
+          [0, 0, 0, 20, 20, 0, 0, 0],
+          [5, -5, -10, 0, 0, -10, -5, 5],
+          [5, 10, 10, -20, -20, 10, 10, 5],
+          [0, 0, 0, 0, 0, 0, 0, 0]],
+    "N": [[-50, -40, -30, -30, -30, -30, -40, -50],
+          [-40, -20, 0, 0, 0, 0, -20, -40],
+          [-30, 0, 10, 15, 15, 10, 0, -30],
+          [-30, 5, 15, 20, 20, 15, 5, -30],
+          [-30, 0, 15, 20, 20, 15, 0, -30],
+          [-30, 5, 10, 15, 15, 10, 5, -30],
+          [-40, -20, 0, 5, 5, 0, -20, -40],
+          [-50, -40, -30, -30, -30, -30, -40, -50]],
+    "B": [[-20, -10, -10, -10, -10, -10, -10, -20],
+          [-10, 0, 0, 0, 0, 0, 0, -10],
+          [-10, 0, 5, 10, 10, 5, 0, -10],
+          [-10, 5, 5, 10, 10, 5, 5, -10],
+          [-10, 0, 10, 10, 10, 10, 0, -10],
+          [-10, 10, 10, 10, 10, 10, 10, -10],
+          [-10, 5, 0, 0, 0, 0, 5, -10],
+          [-20, -10, -10, -10, -10, -10, -10, -20]],
+    "R": [[0, 0, 0, 0, 0, 0, 0, 0],
+          [5, 10, 10, 10, 10, 10, 10, 5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [0, 0, 0, 5, 5, 0, 0, 0]],
+    "Q": [[-20, -10, -10, -5, -5, -10, -10, -20],
+          [-10, 0, 0, 0, 0, 0, 0, -10],
+          [-10, 0, 5, 5, 5, 5, 0, -10],
+          [-5, 0, 5, 5, 5, 5, 0, -5],
+          [0, 0, 5, 5, 5, 5, 0, -5],
+          [-10, 5, 5, 5, 5, 5, 0, -10],
+          [-10, 0, 5, 0, 0, 0, 0, -10],
+          [-20, -10, -10, -5, -5, -10, -10, -20]],
+    "K": [[-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-20, -30, -30, -40, -40, -30, -30, -20],
+          [-10, -20, -20, -20, -20, -20, -20, -10],
+          [20, 20, 0, 0, 0, 0, 20, 20],
+          [20, 30, 10, 0, 0, 10, 30, 20]],
+}
+
+#piece -> 8x8 table with material + square value, sign already set (white positive)
+square_score = {}
+for kind in piece_value:
+    square_score["w" + kind] = [[piece_value[kind] + piece_square[kind][r][c] for c in range(8)] for r in range(8)]
+    square_score["b" + kind] = [[-(piece_value[kind] + piece_square[kind][7 - r][c]) for c in range(8)] for r in range(8)]
+
+mate_score = 100000
+mate_bound = mate_score - 1000 #anything above this is a forced mate
+infinity = 1000000
+check_interval = 512 #nodes between two looks at the clock
+
+exact = 0
+lower_bound = 1 #score is at least value (beta cutoff)
+upper_bound = 2 #score is at most value (failed low)
+
+def evaluate(gs): #material + piece square tables, from the point of view of the side to move
+    score = 0
+    for r in range(8):
+        row = gs.board[r]
+        for c in range(8):
+            piece = row[c]
+            if piece != "--":
+                score += square_score[piece][r][c]
+    return score if gs.white_to_move else -score
+
+class SearchTimeout(Exception):
+    pass
+
+class TranspositionTable():
+    #fixed number of slots (power of two) allocated up front, so memory never grows during a search
+    #every slot holds (key, depth, value, flag, move_ID, generation)
+    #replacement: an entry from an older search is always replaced, otherwise the deeper entry stays
+    def __init__(self, size=1 << 18):
+        if size & (size - 1):
+            raise ValueError("transposition table size has to be a power of two")
+        self.size = size
+        self.mask = size - 1
+        self.slots = [None] * size
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+
+    def new_search(self):
+        self.generation = (self.generation + 1) & 0xFF
+        self.probes = 0
+        self.hits = 0
+
+    def probe(self, key):
+        self.probes += 1
+        entry = self.slots[key & self.mask]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key, depth, value, flag, move_ID):
+        index = key & self.mask
+        entry = self.slots[index]
+        if entry is None or entry[0] == key or entry[5] != self.generation or depth >= entry[1]:
+            self.slots[index] = (key, depth, value, flag, move_ID, self.generation)
+
+    def clear(self):
+        self.slots = [None] * self.size
+
+class SearchResult():
+    def __init__(self, move, score, depth, nodes, seconds, tt_probes, tt_hits, pv):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.seconds = seconds
+        self.nps = int(nodes / seconds) if seconds > 0 else 0
+        self.tt_probes = tt_probes
+        self.tt_hits = tt_hits
+        self.tt_hit_rate = tt_hits / tt_probes if tt_probes else 0.0
+        self.pv = pv
+
+    def as_dict(self):
+        return {"move": self.pv[0] if self.pv else None, "score": self.score, "depth": self.depth,
+                "nodes": self.nodes, "seconds": round(self.seconds, 6), "nps": self.nps,
+                "tt_probes": self.tt_probes, "tt_hits": self.tt_hits,
+                "tt_hit_rate": round(self.tt_hit_rate, 4), "pv": self.pv}
+
+class Searcher():
+    #keeps the tt, killers and history between searches, so one Searcher per game/thread
+    #book (OpeningBook) and endgame (EndgameTable.EndgameTables) are optional, when they know the
+    #position the move comes from them and the search does not run at all
+    def __init__(self, tt_size=1 << 18, book=None, endgame=None):
+        self.tt = TranspositionTable(tt_size)
+        self.book = book
+        self.endgame = endgame
+        self.killers = []
+        self.history = {}
+        self.nodes = 0
+        self.deadline = None
+        self.next_check = 0
+
+    def start_search(self, time_limit, max_depth, deadline=None):
+        #resets the per search state and starts the clock, deadline is an absolute time.time() (the same
+        #moment in every process), it is turned into perf_counter time once so check_time stays one compare
+        self.tt.new_search()
+        self.killers = [[None, None] for i in range(max_depth + 64)]
+        self.history = {}
+        self.nodes = 0
+        self.next_check = check_interval
+        start = time.perf_counter()
+        self.deadline = start + time_limit if time_limit is not None else None
+        if deadline is not None:
+            wall_deadline = start + (deadline - time.time())
+            self.deadline = wall_deadline if self.deadline is None else min(self.deadline, wall_deadline)
+        return start
+
+    def search(self, gs, time_limit=1.0, max_depth=64):
+        #iterative deepening, returns the SearchResult of the deepest finished iteration
+        #the search itself only handles move codes (ints), the result is decoded to a Move at the end
+        start = self.start_search(time_limit, max_depth)
+        if self.book is not None:
+            move = self.book.choose(gs)
+            if move is not None:
+                return SearchResult(move, 0, 0, 0, time.perf_counter() - start, 0, 0, [move.get_uci()])
+        if self.endgame is not None:
+            known = self.endgame.best_move(gs)
+            if known is not None:
+                code, result, plies = known
+                score = {"win": mate_score - plies, "loss": plies - mate_score, "draw": 0}[result]
+                move = ChessEngine.Move.from_code(code, gs.board)
+                return SearchResult(move, score, 0, 0, time.perf_counter() - start, 0, 0, [move.get_uci()])
+        root_ply = len(gs.move_log)
+        root_moves = gs.get_valid_move_codes()
+        best = None
+        if not root_moves:
+            return SearchResult(None, -mate_score if gs.in_check else 0, 0, 0, 0.0, 0, 0, [])
+        for depth in range(1, max_depth + 1):
+            try:
+                score, code = self.search_root(gs, root_moves, depth)
+            except SearchTimeout:
+                while len(gs.move_log) > root_ply: #unwind whatever the aborted iteration left on the board
+                    gs.undo_move()
+                break
+            best = (score, code, depth)
+            if abs(score) >= mate_bound: #found a forced mate, deeper search will not change it
+                break
+            if self.deadline is not None and time.perf_counter() > self.deadline:
+                break
+        if best is None: #not even depth 1 finished, play the first ordered move
+            self.order_moves(gs.board, root_moves, None, 0)
+            best = (-infinity, root_moves[0], 0)
+        seconds = time.perf_counter() - start
+        score, code, depth = best
+        return SearchResult(ChessEngine.Move.from_code(code, gs.board), score, depth, self.nodes, seconds,
+                            self.tt.probes, self.tt.hits, self.principal_variation(gs, code, depth))
+
+    def search_move(self, gs, code, depth, alpha=-infinity, beta=infinity, deadline=None):
+        #scores a single root move at depth (counted from the root) inside the root window (alpha, beta),
+        #fail soft: a score <= alpha is only an upper bound, >= beta only a lower bound
+        #returns (score, depth), (None, 0) when the deadline came first. used by ParallelSearch, the
+        #iterations come from there, earlier ones only left their entries in the tt for the move ordering
+        self.start_search(None, depth, deadline)
+        root_ply = len(gs.move_log)
+        gs.make_move_code(code)
+        try:
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, 1)
+            reached = depth
+        except SearchTimeout:
+            score = None
+            reached = 0
+        while len(gs.move_log) > root_ply:
+            gs.undo_move()
+        return score, reached
+
+    def search_root(self, gs, moves, depth):
+        alpha = -infinity
+        beta = infinity
+        entry = self.tt.probe(gs.zobrist_key)
+        self.order_moves(gs.board, moves, entry[4] if entry is not None else None, 0)
+        best_move = moves[0]
+        for code in moves:
+            gs.make_move_code(code)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, 1)
+            gs.undo_move()
+            if score > alpha:
+                alpha = score
+                best_move = code
+        self.tt.store(gs.zobrist_key, depth, alpha, exact, best_move)
+        #the best move goes first in the next iteration
+        moves.remove(best_move)
+        moves.insert(0, best_move)
+        return alpha, best_move
+
+    def negamax(self, gs, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes >= self.next_check:
+            self.check_time()
+        if gs.halfmove >= 100 or gs.repetitions(): #a position seen before in the game or the search is a draw
+            return 0
+        if depth <= 0:
+            return self.quiescence(gs, alpha, beta, ply)
+
+        key = gs.zobrist_key
+        alpha_orig = alpha
+        tt_move = None
+        entry = self.tt.probe(key)
+        if entry is not None:
+            tt_move = entry[4]
+            if entry[1] >= depth:
+                value = score_from_tt(entry[2], ply)
+                if entry[3] == exact:
+                    return value
+                if entry[3] == lower_bound and value > alpha:
+                    alpha = value
+                elif entry[3] == upper_bound and value < beta:
+                    beta = value
+                if alpha >= beta:
+                    return value
+
+        moves = gs.get_valid_move_codes()
+        if not moves:
+            return -mate_score + ply if gs.in_check else 0
+        board = gs.board
+        self.order_moves(board, moves, tt_move, ply)
+        best = -infinity
+        best_move = moves[0]
+        for code in moves:
+            quiet = not is_tactical(board, code)
+            gs.make_move_code(code)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.undo_move()
+            if score > best:
+                best = score
+                best_move = code
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if quiet: #quiet move that caused a cutoff
+                            killers = self.killers[ply]
+                            if killers[0] != code:
+                                killers[1] = killers[0]
+                                killers[0] = code
+                            self.history[code] = self.history.get(code, 0) + depth * depth
+                        break
+        if best <= alpha_orig:
+            flag = upper_bound
+        elif best >= beta:
+            flag = lower_bound
+        else:
+            flag = exact
+        self.tt.store(key, depth, score_to_tt(best, ply), flag, best_move)
+        return best
+
+    def quiescence(self, gs, alpha, beta, ply): #only captures, so the eval is not taken in the middle of a trade
+        moves = gs.get_valid_move_codes()
+        if not moves:
+            return -mate_score + ply if gs.in_check else 0
+        board = gs.board
+        if gs.in_check: #no standing pat while in check, every evasion is searched
+            self.order_moves(board, moves, None, ply)
+        else:
+            stand_pat = evaluate(gs)
+            if stand_pat >= beta:
+                return stand_pat
+            if stand_pat > alpha:
+                alpha = stand_pat
+            moves = [code for code in moves if is_tactical(board, code)]
+            moves.sort(key=lambda code: mvv_lva(board, code), reverse=True)
+        for code in moves:
+            self.nodes += 1
+            if self.nodes >= self.next_check:
+                self.check_time()
+            gs.make_move_code(code)
+            score = -self.quiescence(gs, -beta, -alpha, ply + 1)
+            gs.undo_move()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def check_time(self): #called every check_interval nodes, looking at the clock every node is too slow
+        self.next_check = self.nodes + check_interval
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+    def order_moves(self, board, moves, tt_move, ply):
+        killers = self.killers[ply] if ply < len(self.killers) else (None, None)
+        history = self.history
+        def key(code):
+            if code == tt_move:
+                return 10000000
+            if is_tactical(board, code):
+                return 1000000 + mvv_lva(board, code)
+            if code == killers[0]:
+                return 900000
+            if code == killers[1]:
+                return 800000
+            return history.get(code, 0)
+        moves.sort(key=key, reverse=True)
+
+    def principal_variation(self, gs, code, depth): #follows the tt from the root, in e2e4 style
+        pv = []
+        made = 0
+        while code is not None and made < depth:
+            move = ChessEngine.Move.from_code(code, gs.board)
+            gs.make_move(move)
+            pv.append(move.get_uci())
+            made += 1
+            entry = self.tt.probe(gs.zobrist_key)
+            code = entry[4] if entry is not None and entry[4] in gs.get_valid_move_codes() else None
+        for i in range(made):
+            gs.undo_move()
+        return pv
+
+def is_tactical(board, code): #captures (en passant too) and promotions, what quiescence searches
+    return board[(code >> 3) & 7][code & 7] != "--" or (code >> 12) & tactical_flags != 0
+
+tactical_flags = ChessEngine.flag_en_passant | ChessEngine.flag_promotion
+
+def mvv_lva(board, code): #most valuable victim first, cheapest attacker first among equal victims
+    #a promotion counts as winning the new piece minus the pawn
+    victim = board[(code >> 3) & 7][code & 7]
+    flag = code >> 12
+    value = piece_value[victim[1]] * 10 if victim != "--" else 0
+    if flag == ChessEngine.flag_en_passant:
+        value = piece_value["p"] * 10
+    elif flag & ChessEngine.flag_promotion:
+        value += (piece_value["NBRQ"[flag & 3]] - piece_value["p"]) * 10
+    if not value:
+        return 0
+    return value - piece_value[board[(code >> 9) & 7][(code >> 6) & 7][1]] // 100
+
+def score_to_tt(score, ply): #mate scores are stored relative to the node, not the root
+    if score >= mate_bound:
+        return score + ply
+    if score <= -mate_bound:
+        return score - ply
+    return score
+
+def score_from_tt(score, ply):
+    if score >= mate_bound:
+        return score - ply
+    if score <= -mate_bound:
+        return score + ply
+    return score
+
+def find_best_move(gs, time_limit=1.0, max_depth=64, searcher=None):
+    if searcher is None:
+        searcher = Searcher()
+    return searcher.search(gs, time_limit, max_depth)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="search one position and print the report as json")
+    parser.add_argument("--fen", default=ChessEngine.start_fen)
+    parser.add_argument("--time", type=float, default=1.0, help="time budget in seconds")
+    parser.add_argument("--depth", type=int, default=64, help="maximum depth")
+    parser.add_argument("--backend", default="board", choices=["board", "bitboard"])
+    parser.add_argument("--tt-size", type=int, default=1 << 18, help="transposition table slots, power of two")
+    parser.add_argument("--book", default=None, help="opening book file from OpeningBook.py")
+    parser.add_argument("--tables", default=None, help="directory with endgame tables from EndgameTable.py")
+    args = parser.parse_args(argv)
+    #the book and the tables are optional, their modules are only loaded when asked for
+    if args.book:
+        import OpeningBook
+    if args.tables:
+        import EndgameTable
+    gs = ChessEngine.GameState(args.backend)
+    gs.set_fen(args.fen)
+    book = OpeningBook.OpeningBook(args.book) if args.book else None
+    endgame = EndgameTable.EndgameTables(args.tables) if args.tables else None
+    result = Searcher(args.tt_size, book, endgame).search(gs, args.time, args.depth)
+    json.dump(result.as_dict(), sys.stdout, indent=2)
+    print()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,8 +4,13 @@ also responsible for determining the valid moves at the current state
 will also keep a move log
 """
 
+from collections import OrderedDict
+
+import Bitboard
+import Zobrist
+
 class GameState():
-    def __init__(self):
+    def __init__(self, backend="board", debug=False, move_cache=None):
         #board is 8x8, 2d list, each element of the list has 2 char
         #first char represents color, second character represents the type
         #"--" represents empty space
@@ -25,81 +30,322 @@ class GameState():
         self.white_king_location = (7,4)
         self.black_king_location = (0,4)
         self.in_check = False
-        self.pins = []
-        self.checks = []
+        self.pin_directions = {} #square of a pinned piece -> direction from the king to it
         self.checkmate = False
         self.stalemate = False
+        #backend "board" generates moves by walking self.board, "bitboard" generates them from 64 bit ints
+        #the bitboards are kept up to date with either backend, the attack map below is built from them
+        #and self.board stays up to date too so the gui can keep drawing from it
+        if backend not in ("board", "bitboard"):
+            raise ValueError("unknown backend " + repr(backend))
+        self.backend = backend
+        self.bitboards = Bitboard.BitboardBoard(self.board)
+        #checks, pins and attacked squares of the current position (Bitboard.AttackInfo)
+        #built at most once per position, make_move pushes it and undo_move pops it back without recomputing
+        self.attack_info = None
+        #castling rights (Bitboard.castle_* bits), en passant target square (Bitboard.no_en_passant if no
+        #pawn can take en passant) and the halfmove clock for the 50 move rule
+        self.castling = 15
+        self.en_passant = Bitboard.no_en_passant
+        self.halfmove = 0
+        #one entry per move in move_log: (attack map, zobrist key, castling | en_passant << 4 | halfmove << 11)
+        #of the position before the move, so undo_move restores everything in O(1) without recomputing
+        #the keys in it are also the hash history for repetitions
+        self.undo_stack = []
+        #64 bit position key, updated incrementally by make_move
+        #with debug=True every update is checked against a full recompute
+        self.debug = debug
+        self.zobrist_key = Zobrist.compute_hash(self.board, self.white_to_move, self.castling)
+        #fullmove number of the position the move log starts from (for get_fen)
+        self.fen_counters = (0, 1)
+        #optional MoveCache of legal move lists keyed by zobrist_key, can be shared by several GameStates
+        #make_move/undo_move change the key, so a move never sees the moves of another position
+        self.move_cache = move_cache
+
+    def set_position(self, board, white_to_move, castling=0, en_passant=Bitboard.no_en_passant, halfmove=0):
+        #replaces the whole position, board is an 8x8 list like self.board
+        #castling rights without the king and rook on their squares and an en passant square no pawn can
+        #take on are dropped, so the same position always gets the same key
+        #ValueError for a position that can not come up in a game (see check_position), nothing is changed then
+        bitboards = Bitboard.BitboardBoard(board)
+        check_position(board, white_to_move, bitboards)
+        self.board = [row[:] for row in board]
+        self.white_to_move = white_to_move
+        self.move_log = []
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] == "wK":
+                    self.white_king_location = (r, c)
+                elif self.board[r][c] == "bK":
+                    self.black_king_location = (r, c)
+        self.in_check = False
+        self.pin_directions = {}
+        self.checkmate = False
+        self.stalemate = False
+        self.bitboards = bitboards
+        self.attack_info = None
+        self.castling = castling & castling_possible(self.board)
+        self.en_passant = en_passant_square(self.board, white_to_move, en_passant)
+        self.halfmove = halfmove
+        self.undo_stack = []
+        self.zobrist_key = Zobrist.compute_hash(self.board, self.white_to_move, self.castling, self.en_passant)
+        self.fen_counters = (halfmove, 1)
+
+    def set_fen(self, fen): #replaces the whole position with the one in the fen string
+        board, white_to_move, castling, en_passant, halfmove, fullmove = parse_fen(fen)
+        self.set_position(board, white_to_move, castling, en_passant, halfmove)
+        self.fen_counters = (halfmove, fullmove)
+
+    def get_fen(self):
+        rows = []
+        for row in self.board:
+            text = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                text += piece_to_fen[piece]
+            if empty:
+                text += str(empty)
+            rows.append(text)
+        castling = "".join(ch for bit, ch in zip((1, 2, 4, 8), "KQkq") if self.castling & bit) or "-"
+        if self.en_passant == Bitboard.no_en_passant:
+            en_passant = "-"
+        else:
+            en_passant = Move.col_to_file[self.en_passant % 8] + Move.row_to_rank[self.en_passant // 8]
+        plies = len(self.move_log)
+        black_started = self.white_to_move != (plies % 2 == 0)
+        fullmove = self.fen_counters[1] + (plies + black_started) // 2
+        return "%s %s %s %s %d %d" % ("/".join(rows), "w" if self.white_to_move else "b", castling, en_passant,
+                                      self.halfmove, fullmove)
 
     def make_move(self, move): #takes a move as parameter and executes it in the board
-        self.board[move.start_row][move.start_col] = "--"
-        self.board[move.end_row][move.end_col] = move.piece_moved
+        board = self.board
+        self.undo_stack.append((self.attack_info, self.zobrist_key,
+                                self.castling | self.en_passant << 4 | self.halfmove << 11))
+        self.attack_info = None
+        key = self.zobrist_key ^ Zobrist.move_delta(move)
+        moved = move.piece_moved
+        board[move.start_row][move.start_col] = "--"
+        board[move.end_row][move.end_col] = moved
+        flag = move.move_ID >> 12
+        if flag: #the rare moves, one branch for all of them
+            if flag & Bitboard.flag_promotion:
+                board[move.end_row][move.end_col] = moved[0] + Bitboard.promotion_pieces[flag & 3]
+            elif flag == Bitboard.flag_en_passant:
+                board[move.start_row][move.end_col] = "--"
+            else: #castling, the rook jumps over the king
+                rook_start, rook_end = Bitboard.castle_rooks[move.end_row*8 + move.end_col]
+                board[move.end_row][rook_end % 8] = board[move.end_row][rook_start % 8]
+                board[move.end_row][rook_start % 8] = "--"
         self.move_log.append(move)
         self.white_to_move = not self.white_to_move
-        if move.piece_moved == "wK":
+        if moved == "wK":
             self.white_king_location = (move.end_row, move.end_col)
-        if move.piece_moved == "bK":
+        if moved == "bK":
             self.black_king_location = (move.end_row, move.end_col)
-        
+        self.bitboards.make_move(move)
+
+        castling = self.castling
+        if castling:
+            castling &= castle_mask[move.start_row*8 + move.start_col] & castle_mask[move.end_row*8 + move.end_col]
+            if castling != self.castling:
+                key ^= Zobrist.castling_keys[self.castling] ^ Zobrist.castling_keys[castling]
+                self.castling = castling
+        if self.en_passant != no_en_passant:
+            key ^= Zobrist.en_passant_keys[self.en_passant & 7]
+            self.en_passant = no_en_passant
+        if moved[1] == "p":
+            self.halfmove = 0
+            if move.start_row - move.end_row in (2, -2): #double push, the square behind may be taken en passant
+                self.en_passant = en_passant_square(board, self.white_to_move,
+                                                    (move.start_row + move.end_row) * 4 + move.end_col)
+                if self.en_passant != no_en_passant:
+                    key ^= Zobrist.en_passant_keys[move.end_col]
+        elif move.piece_capt != "--":
+            self.halfmove = 0
+        else:
+            self.halfmove += 1
+        self.zobrist_key = key
+        if self.debug:
+            self.check_hash()
+
     def undo_move(self):
         if len(self.move_log)!=0:
             move = self.move_log.pop()
-            self.board[move.start_row][move.start_col] = move.piece_moved
-            self.board[move.end_row][move.end_col] = move.piece_capt
+            board = self.board
+            board[move.start_row][move.start_col] = move.piece_moved
+            board[move.end_row][move.end_col] = move.piece_capt
+            if move.move_ID >> 12: #en passant and castling moved a third piece
+                flag = move.move_ID >> 12
+                if flag == flag_en_passant:
+                    board[move.end_row][move.end_col] = "--"
+                    board[move.start_row][move.end_col] = move.piece_capt
+                elif flag == flag_castle:
+                    rook_start, rook_end = Bitboard.castle_rooks[move.end_row*8 + move.end_col]
+                    board[move.end_row][rook_start % 8] = board[move.end_row][rook_end % 8]
+                    board[move.end_row][rook_end % 8] = "--"
             self.white_to_move = not self.white_to_move
             if move.piece_moved == "wK":
                 self.white_king_location = (move.start_row, move.start_col)
             if move.piece_moved == "bK":
                 self.black_king_location = (move.start_row, move.start_col)
-    
-    def get_valid_move(self): #considering checkmate/checks
+            self.bitboards.undo_move(move)
+            self.attack_info, self.zobrist_key, state = self.undo_stack.pop()
+            self.castling = state & 15
+            self.en_passant = (state >> 4) & 127
+            self.halfmove = state >> 11
+            if self.debug:
+                self.check_hash()
+
+    def repetitions(self): #how many times the current position was on the board before
+        #only positions with the same side to move since the last pawn move or capture can repeat it
+        key = self.zobrist_key
+        stack = self.undo_stack
+        count = 0
+        i = len(stack) - 2
+        stop = max(len(stack) - self.halfmove, 0)
+        while i >= stop:
+            if stack[i][1] == key:
+                count += 1
+            i -= 2
+        return count
+
+    def get_draw(self): #"threefold repetition", "fifty move rule" or None, call after get_valid_move (mate comes first)
+        if self.checkmate:
+            return None
+        if self.halfmove >= 100:
+            return "fifty move rule"
+        if self.repetitions() >= 2:
+            return "threefold repetition"
+        return None
+
+    def check_hash(self): #debug check, the incremental key has to match a full recompute
+        full_key = Zobrist.compute_hash(self.board, self.white_to_move, self.castling, self.en_passant)
+        if self.zobrist_key != full_key:
+            raise AssertionError("zobrist key out of sync: %016x != %016x" % (self.zobrist_key, full_key))
+
+    def get_valid_move(self): #considering checkmate/checks, as Move objects for the gui and the notation
+        board = self.board
+        return [Move.from_code(code, board) for code in self.get_valid_move_codes()]
+
+    def get_valid_move_codes(self): #same moves as get_valid_move but as 16 bit ints, see Move.from_code
+        cache = self.move_cache
+        if cache is None:
+            moves = self.generate_move_codes()
+        else:
+            entry = cache.get(self.zobrist_key)
+            if entry is None:
+                moves = self.generate_move_codes()
+                cache.put(self.zobrist_key, tuple(moves), self.in_check)
+            else:
+                moves = list(entry[0]) #a copy, callers may sort or filter the list
+                self.in_check = entry[1]
+                if self.debug:
+                    self.check_move_cache(moves)
+        if len(moves)==0:
+            if self.in_check:
+                self.checkmate = True
+            else:
+                self.stalemate = True
+        else: #reset, the flags may still be set from a position we undid
+            self.checkmate = False
+            self.stalemate = False
+        return moves
+
+    def generate_move_codes(self): #runs the move generator of the backend, sets in_check
         #algo
         #1 see if any pieces are in check
         #2 see if any pieces are pinned
         #3 see if there is double check
-        moves = []
-        self.in_check, self.pins, self.checks = self.check_pin_check()
-        if self.white_to_move:
-            king_row = self.white_king_location[0]
-            king_col = self.white_king_location[1]
+        info = self.get_attack_info()
+        if self.backend == "bitboard":
+            moves = []
+            self.in_check = self.bitboards.get_valid_move(self.white_to_move, moves, info, self.castling, self.en_passant)
         else:
-            king_row = self.black_king_location[0]
-            king_col = self.black_king_location[1]
+            moves = self.get_valid_move_board(info)
+        return moves
+
+    def check_move_cache(self, moves): #debug check, a cached move list has to match a fresh one
+        in_check = self.in_check
+        fresh = self.generate_move_codes()
+        if sorted(fresh) != sorted(moves) or self.in_check != in_check:
+            raise AssertionError("move cache out of sync for key %016x" % self.zobrist_key)
+
+    def get_valid_move_board(self, info): #the generator that walks self.board, checks and pins come from info
+        moves = []
+        self.in_check = info.in_check
+        king_start = info.king_square
+        king_row = king_start // 8
+        king_col = king_start % 8
+        self.pin_directions = {}
+        for sq in info.pin_lines:
+            self.pin_directions[sq] = direction(king_row, king_col, sq // 8, sq % 8)
         if self.in_check:
-            if len(self.checks)==1:
+            if info.check_mask: #cuma satu check
                 moves = self.get_possible_moves()
                 #kalo mau ngeblock check harus ada piece yang digerakin supaya ngehalangin checking piece sm king
-                check = self.checks[0]
-                check_row = check[0]
-                check_col = check[1]
-                check_piece = self.board[check_row][check_col]
-                valid_square = [] #kotak yg bisa ditaro pieces
                 #kalo knight, knight harus di capture ato king harus di move
-                #else bisa di block
-                if check_piece[1] == "N":
-                    valid_square = [(check_row, check_col)]
-                else:
-                    for i in range(1,8):
-                        kotak_valid = (king_row + check[2]*i, king_col + check[3]*i)
-                        valid_square.append(kotak_valid)
-                        if kotak_valid[0] == check_row and kotak_valid[1] == check_col:
-                            break
-                for i in range(len(moves)-1, -1, -1):
-                    if moves[i].piece_moved[1] != "K":
-                        if (moves[i].end_row, moves[i].end_col) not in valid_square:
-                            moves.remove(moves[i])
+                #check_mask udah berisi kotak yg bisa ditaro pieces (checking piece + kotak di antaranya)
+                valid_square = info.check_mask
+                #filter in place, king moves stay (they were already checked in get_king_moves)
+                j = 0
+                for move in moves:
+                    if move >> 6 == king_start or (valid_square >> (move & 63)) & 1:
+                        moves[j] = move
+                        j += 1
+                del moves[j:]
             else:
                 self.get_king_moves(king_row, king_col, moves)
 
         else:
             moves = self.get_possible_moves()
-        if len(moves)==0:
-            if self.in_check:
-                self.checkmate = True
-            else:
-                self.stalemate = True
+        if self.en_passant != no_en_passant and info.check_mask: #tested on their own, not by the filter
+            self.bitboards.en_passant_moves(self.white_to_move, self.en_passant, moves)
         return moves
 
-    def check_pin_check(self): #ngecek apakah si king (color based on turn) kena check/ada piece kena pin
+    def get_attack_info(self): #attack map of the current position, built on first use
+        if self.attack_info is None:
+            self.attack_info = self.bitboards.attack_info(self.white_to_move)
+            if self.debug:
+                self.check_attack_info()
+        return self.attack_info
+
+    def make_move_code(self, code): #make_move for a move from get_valid_move_codes
+        self.make_move(Move.from_code(code, self.board))
+
+    def check_pin_check(self): #in_check, pins, checks in the old list format, read from the attack map
+        info = self.get_attack_info()
+        king_row = info.king_square // 8
+        king_col = info.king_square % 8
+        pins = []
+        for sq in info.pin_lines:
+            pins.append((sq // 8, sq % 8) + direction(king_row, king_col, sq // 8, sq % 8))
+        checks = []
+        bb = info.checkers
+        while bb:
+            b = bb & -bb
+            sq = b.bit_length() - 1
+            bb ^= b
+            if self.board[sq // 8][sq % 8][1] == "N": #knight checks keep the knight jump as direction
+                checks.append((sq // 8, sq % 8, sq // 8 - king_row, sq % 8 - king_col))
+            else:
+                checks.append((sq // 8, sq % 8) + direction(king_row, king_col, sq // 8, sq % 8))
+        return info.in_check, pins, checks
+
+    def check_attack_info(self): #debug check, the attack map has to agree with a full ray rescan
+        in_check, pins, checks = self.check_pin_check()
+        scan_in_check, scan_pins, scan_checks = self.rescan_pin_check()
+        if in_check != scan_in_check or sorted(pins) != sorted(scan_pins) or sorted(checks) != sorted(scan_checks):
+            raise AssertionError("attack map out of sync: %r != %r" % ((in_check, pins, checks),
+                                                                       (scan_in_check, scan_pins, scan_checks)))
+
+    def rescan_pin_check(self): #ngecek apakah si king (color based on turn) kena check/ada piece kena pin
+        #walks every ray from the king, only used to verify the attack map (debug) and in the benchmark
         pins = [] #lokasi piece yang kena pin (allied) dan arah dari mana pinned nya
         checks = [] #lokasi dari mana king kena check
         in_check = False
@@ -172,54 +418,50 @@ class GameState():
                     
     #buat dapetin semua moves possible buat tiap piece di row, trus masukin ke list
     def get_pawn_moves(self, r, c, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0]==r and self.pins[i][1]==c:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
+        pin_direction = self.pin_directions.get(r*8 + c, ())
+        piece_pinned = pin_direction != ()
+        promote = r == (1 if self.white_to_move else 6) #every move of this pawn is a promotion
+        if promote:
+            first = len(moves)
 
         if self.white_to_move: #focus on the white pawns
             if self.board[r-1][c] == "--": #one square move
-                if not piece_pinned or pin_direction == (-1,0):
-                    moves.append(Move((r,c), (r-1,c), self.board))
+                if not piece_pinned or pin_direction in ((-1,0), (1,0)):
+                    moves.append(r << 9 | c << 6 | (r-1) << 3 | c)
                     if r == 6 and self.board[r-2][c]=="--": #two square move
-                        moves.append(Move((r,c), (r-2,c), self.board))
+                        moves.append(r << 9 | c << 6 | (r-2) << 3 | c)
             if c-1 >= 0:
                 if self.board[r-1][c-1][0] == "b": #jika ada enemy piece to capture
-                    if not piece_pinned or pin_direction == (-1,-1):
-                        moves.append(Move((r,c), (r-1,c-1), self.board))
+                    if not piece_pinned or pin_direction in ((-1,-1), (1,1)):
+                        moves.append(r << 9 | c << 6 | (r-1) << 3 | (c-1))
             if c+1 <= 7:
                 if self.board[r-1][c+1][0] == "b":
-                    if not piece_pinned or pin_direction == (-1,1):
-                        moves.append(Move((r,c), (r-1,c+1), self.board))
+                    if not piece_pinned or pin_direction in ((-1,1), (1,-1)):
+                        moves.append(r << 9 | c << 6 | (r-1) << 3 | (c+1))
         else:
             if self.board[r+1][c] == "--":
-                if not piece_pinned or pin_direction == (1,0):
-                    moves.append(Move((r,c), (r+1,c), self.board))
+                if not piece_pinned or pin_direction in ((1,0), (-1,0)):
+                    moves.append(r << 9 | c << 6 | (r+1) << 3 | c)
                     if r == 1 and self.board[r+2][c]=="--":
-                        moves.append(Move((r,c), (r+2,c), self.board))
+                        moves.append(r << 9 | c << 6 | (r+2) << 3 | c)
             if c-1 >= 0:
                 if self.board[r+1][c-1][0] == "w":
-                    if not piece_pinned or pin_direction == (1,-1):
-                        moves.append(Move((r,c), (r+1,c-1), self.board))
+                    if not piece_pinned or pin_direction in ((1,-1), (-1,1)):
+                        moves.append(r << 9 | c << 6 | (r+1) << 3 | (c-1))
             if c+1 <= 7:
                 if self.board[r+1][c+1][0] == "w":
-                    if not piece_pinned or pin_direction == (1,1):
-                        moves.append(Move((r,c), (r+1,c+1), self.board))
+                    if not piece_pinned or pin_direction in ((1,1), (-1,-1)):
+                        moves.append(r << 9 | c << 6 | (r+1) << 3 | (c+1))
+        if promote: #one move for every piece the pawn can become
+            codes = moves[first:]
+            del moves[first:]
+            for code in codes:
+                for flag in Bitboard.promotion_flags:
+                    moves.append(flag << 12 | code)
 
     def get_rook_moves(self, r, c, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0]==r and self.pins[i][1]==c:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                if self.board[r][c][1] != "Q": #kalo queen jangan di remove
-                    self.pins.remove(self.pins[i])
-                break
+        pin_direction = self.pin_directions.get(r*8 + c, ())
+        piece_pinned = pin_direction != ()
 
         directions = ((-1, 0), (0, -1), (1,0), (0,1))
         enemy_color = "b" if self.white_to_move else "w"
@@ -230,9 +472,9 @@ class GameState():
                 if end_row>=0 and end_row<=7 and end_col>=0 and end_col<=7:
                     if not piece_pinned or pin_direction == d or pin_direction == (-d[0], -d[1]):
                         if self.board[end_row][end_col] == "--":
-                            moves.append(Move((r,c), (end_row,end_col), self.board))
+                            moves.append(r << 9 | c << 6 | end_row << 3 | end_col)
                         elif self.board[end_row][end_col][0] == enemy_color:
-                            moves.append(Move((r,c), (end_row,end_col), self.board))
+                            moves.append(r << 9 | c << 6 | end_row << 3 | end_col)
                             break
                         else:
                             break
@@ -240,14 +482,8 @@ class GameState():
                     break
 
     def get_bishop_moves(self, r, c, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0]==r and self.pins[i][1]==c:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
+        pin_direction = self.pin_directions.get(r*8 + c, ())
+        piece_pinned = pin_direction != ()
 
         directions = ((1,1), (-1,1), (1,-1), (-1,-1))
         enemy_color = "b" if self.white_to_move else "w"
@@ -258,9 +494,9 @@ class GameState():
                 if 0 <= end_row < 8 and 0 <= end_col < 8:
                     if not piece_pinned or pin_direction == d or pin_direction == (-d[0], -d[1]):
                         if self.board[end_row][end_col] == "--":
-                            moves.append(Move((r,c), (end_row,end_col), self.board))
+                            moves.append(r << 9 | c << 6 | end_row << 3 | end_col)
                         elif self.board[end_row][end_col][0] == enemy_color:
-                            moves.append(Move((r,c), (end_row,end_col), self.board))
+                            moves.append(r << 9 | c << 6 | end_row << 3 | end_col)
                             break
                         else:
                             break
@@ -268,12 +504,7 @@ class GameState():
                     break
     
     def get_knight_moves(self, r, c, moves):
-        piece_pinned = False
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0]==r and self.pins[i][1]==c:
-                piece_pinned = True
-                self.pins.remove(self.pins[i])
-                break
+        piece_pinned = r*8 + c in self.pin_directions
 
         directions = ((-2, 1), (-1, 2), (1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1))
         enemy_color = "b" if self.white_to_move else "w"
@@ -283,9 +514,9 @@ class GameState():
             if 0 <= end_row < 8 and 0 <= end_col < 8:
                 if not piece_pinned:
                     if self.board[end_row][end_col] == "--":
-                        moves.append(Move((r,c), (end_row,end_col), self.board))
+                        moves.append(r << 9 | c << 6 | end_row << 3 | end_col)
                     elif self.board[end_row][end_col][0] == enemy_color:
-                        moves.append(Move((r,c), (end_row,end_col), self.board))
+                        moves.append(r << 9 | c << 6 | end_row << 3 | end_col)
     
     def get_queen_moves(self, r, c, moves):
         self.get_bishop_moves(r, c, moves)
@@ -294,44 +525,234 @@ class GameState():
     def get_king_moves(self, r, c, moves):
         directions = ((-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1))
         ally_color = "w" if self.white_to_move else "b"
+        info = self.get_attack_info() #kotak yg diserang musuh, udah ngitung king nya ga ada di kotak asal
         for d in directions:
             end_row = r + d[0]
             end_col = c + d[1]
             if 0 <= end_row < 8 and 0 <= end_col < 8:
                 if self.board[end_row][end_col][0] != ally_color:
-                    if ally_color == "w":
-                        self.white_king_location = (end_row, end_col)
-                    else:
-                        self.black_king_location = (end_row, end_col)
-                    in_check, pins, checks = self.check_pin_check()
-                    if not in_check:
-                        moves.append(Move((r,c), (end_row, end_col), self.board))
-                    if ally_color == "w":
-                        self.white_king_location = (r, c)
-                    else:
-                        self.black_king_location = (r, c)
+                    if not info.is_attacked(end_row*8 + end_col):
+                        moves.append(r << 9 | c << 6 | end_row << 3 | end_col)
+        if self.castling & Bitboard.color_rights[ally_color] and not info.in_check:
+            self.bitboards.castle_moves(self.white_to_move, self.castling, moves)
+
+start_fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+fen_to_piece = {"P": "wp", "N": "wN", "B": "wB", "R": "wR", "Q": "wQ", "K": "wK",
+                "p": "bp", "n": "bN", "b": "bB", "r": "bR", "q": "bQ", "k": "bK"}
+piece_to_fen = {v:k for k, v in fen_to_piece.items()}
+fen_to_castling = {"K": Bitboard.castle_white_king, "Q": Bitboard.castle_white_queen,
+                   "k": Bitboard.castle_black_king, "q": Bitboard.castle_black_queen}
+
+#move code flags and the rest of the special move tables, see Bitboard
+flag_en_passant = Bitboard.flag_en_passant
+flag_castle = Bitboard.flag_castle
+flag_promotion = Bitboard.flag_promotion
+castle_mask = Bitboard.castle_mask
+no_en_passant = Bitboard.no_en_passant
+
+def check_position(board, white_to_move, bitboards):
+    #ValueError unless each side has exactly one king, no pawn stands on the first or last rank and the side
+    #that just moved is not in check, the move generator and the attack map take all three for granted
+    for color, name in (("w", "white"), ("b", "black")):
+        kings = sum(row.count(color + "K") for row in board)
+        if kings != 1:
+            raise ValueError("%s needs exactly one king, the position has %d" % (name, kings))
+    for r in (0, 7):
+        if "wp" in board[r] or "bp" in board[r]:
+            raise ValueError("pawn on rank %d" % (8 - r))
+    mover, waiting = ("w", "b") if white_to_move else ("b", "w")
+    king = bitboards.pieces[waiting + "K"].bit_length() - 1
+    if bitboards.attackers_to(king, mover, bitboards.occupied):
+        raise ValueError("the side not to move is in check")
+
+def castling_possible(board): #the castling rights the king and rook squares of board still allow
+    rights = 0
+    for right, king, target, empty, crossed in Bitboard.castle_paths["w"] + Bitboard.castle_paths["b"]:
+        rook = Bitboard.castle_rooks[target][0]
+        color = board[king // 8][king % 8][0]
+        if board[king // 8][king % 8][1] == "K" and board[rook // 8][rook % 8] == color + "R" and \
+                (color == "w") == (king == 60):
+            rights |= right
+    return rights
+
+def en_passant_square(board, white_to_move, sq):
+    #sq if the side to move has a pawn next to the pawn that just jumped over sq, else Bitboard.no_en_passant
+    #so the key and the fen only have an en passant square when the capture is there (pins aside)
+    if sq == Bitboard.no_en_passant:
+        return sq
+    r, c = divmod(sq, 8)
+    if white_to_move:
+        pawn_row, ally, enemy = 3, "wp", "bp"
+    else:
+        pawn_row, ally, enemy = 4, "bp", "wp"
+    if r != (2 if white_to_move else 5) or board[r][c] != "--" or board[pawn_row][c] != enemy:
+        return Bitboard.no_en_passant
+    if (c > 0 and board[pawn_row][c-1] == ally) or (c < 7 and board[pawn_row][c+1] == ally):
+        return sq
+    return Bitboard.no_en_passant
+
+def parse_fen(fen):
+    #returns (board, white_to_move, castling rights, en passant square, halfmove clock, fullmove number)
+    fields = fen.split()
+    if not fields:
+        raise ValueError("empty fen")
+    board = []
+    for rank in fields[0].split("/"):
+        row = []
+        for ch in rank:
+            if ch.isdigit():
+                row.extend(["--"] * int(ch))
+            elif ch in fen_to_piece:
+                row.append(fen_to_piece[ch])
+            else:
+                raise ValueError("bad fen piece " + repr(ch))
+        if len(row) != 8:
+            raise ValueError("bad fen rank " + repr(rank))
+        board.append(row)
+    if len(board) != 8:
+        raise ValueError("bad fen " + repr(fen))
+    if len(fields) > 1 and fields[1] not in ("w", "b"):
+        raise ValueError("bad fen side to move " + repr(fields[1]))
+    white_to_move = len(fields) < 2 or fields[1] == "w"
+    castling = 0
+    if len(fields) > 2 and fields[2] != "-":
+        for ch in fields[2]:
+            if ch not in fen_to_castling:
+                raise ValueError("bad fen castling " + repr(fields[2]))
+            castling |= fen_to_castling[ch]
+    en_passant = Bitboard.no_en_passant
+    if len(fields) > 3 and fields[3] != "-":
+        square = fields[3]
+        if len(square) != 2 or square[0] not in Move.file_to_col or square[1] not in ("3", "6"):
+            raise ValueError("bad fen en passant square " + repr(square))
+        en_passant = Move.rank_to_row[square[1]] * 8 + Move.file_to_col[square[0]]
+    try:
+        halfmove = int(fields[4]) if len(fields) > 4 else 0
+        fullmove = int(fields[5]) if len(fields) > 5 else 1
+    except ValueError:
+        raise ValueError("bad fen move counters " + repr(fen))
+    return board, white_to_move, castling, en_passant, halfmove, fullmove
+
+class MoveCache():
+    #bounded memo of legal move lists: zobrist key -> (tuple of move codes, in_check)
+    #checkmate/stalemate are not stored, get_valid_move_codes derives them from the moves and in_check
+    #policy "lru" drops the least recently used entry when full, "fifo" the oldest inserted one
+    def __init__(self, max_entries=4096, policy="lru"):
+        if policy not in ("lru", "fifo"):
+            raise ValueError("unknown cache policy " + repr(policy))
+        if max_entries < 1:
+            raise ValueError("max_entries has to be at least 1")
+        self.max_entries = max_entries
+        self.policy = policy
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.policy == "lru":
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, moves, in_check):
+        entries = self.entries
+        if key in entries:
+            entries.move_to_end(key)
+        elif len(entries) >= self.max_entries:
+            entries.popitem(last=False)
+            self.evictions += 1
+        entries[key] = (moves, in_check)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"entries": len(self.entries), "max_entries": self.max_entries, "policy": self.policy,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None}
+
+def direction(from_row, from_col, to_row, to_col): #unit step from one square toward another on the same line
+    return ((to_row > from_row) - (to_row < from_row), (to_col > from_col) - (to_col < from_col))
 
 class Move():
     rank_to_row = {"1":7, "2":6, "3":5, "4":4, "5":3, "6":2, "7":1, "8":0}
     row_to_rank = {v:k for k, v in rank_to_row.items()}
     file_to_col = {"a":0, "b":1, "c":2, "d":3, "e":4, "f":5, "g":6, "h":7}
     col_to_file = {v:k for k, v in file_to_col.items()}
+    #no __dict__, a move is only these fields
+    __slots__ = ("start_row", "start_col", "end_row", "end_col", "piece_moved", "piece_capt", "move_ID")
 
-    def __init__(self, start, end, board):
+    def __init__(self, start, end, board, promotion="Q"):
+        #a move from two clicked squares, the special moves are recognised from the board
+        #(promotion is the piece letter a pawn reaching the last rank becomes)
         self.start_row = start[0]
         self.start_col = start[1]
         self.end_row = end[0]
         self.end_col = end[1]
         self.piece_moved = board[self.start_row][self.start_col]
         self.piece_capt = board[self.end_row][self.end_col]
-        self.move_ID = self.start_row*1000 + self.start_col*100 + self.end_row*10 + self.end_col
+        flag = 0
+        if self.piece_moved[1] == "p":
+            if self.end_row in (0, 7):
+                flag = flag_promotion | Bitboard.promotion_pieces.index(promotion)
+            elif self.start_col != self.end_col and self.piece_capt == "--":
+                flag = flag_en_passant
+                self.piece_capt = board[self.start_row][self.end_col]
+        elif self.piece_moved[1] == "K" and self.end_col - self.start_col in (2, -2):
+            flag = flag_castle
+        #move_ID is the 16 bit move code: flag << 12 | start square << 6 | end square, square = row*8 + col
+        self.move_ID = flag << 12 | self.start_row << 9 | self.start_col << 6 | self.end_row << 3 | self.end_col
+
+    @classmethod
+    def from_code(cls, code, board): #decodes a move code from get_valid_move_codes, board is the position before the move
+        move = cls.__new__(cls)
+        move.start_row = (code >> 9) & 7
+        move.start_col = (code >> 6) & 7
+        move.end_row = (code >> 3) & 7
+        move.end_col = code & 7
+        move.piece_moved = board[move.start_row][move.start_col]
+        if code >> 12 == flag_en_passant:
+            move.piece_capt = board[move.start_row][move.end_col]
+        else:
+            move.piece_capt = board[move.end_row][move.end_col]
+        move.move_ID = code
+        return move
+
+    @property
+    def promotion(self): #the piece a promoting pawn becomes ("wQ"), None for every other move
+        flag = self.move_ID >> 12
+        if flag & flag_promotion:
+            return self.piece_moved[0] + Bitboard.promotion_pieces[flag & 3]
+        return None
+
+    @property
+    def is_castle(self):
+        return self.move_ID >> 12 == flag_castle
+
+    @property
+    def is_en_passant(self):
+        return self.move_ID >> 12 == flag_en_passant
 
     def __eq__(self, other):
         if isinstance(other, Move):
             return self.move_ID == other.move_ID
         return False
 
-    def get_notation(self, gs):
+    def __hash__(self):
+        return self.move_ID
+
+    def get_notation(self, gs, legal=None):
+        #the + and # come from gs (so call it after the move is made), legal is the move list of the
+        #position before the move, only needed to tell apart two pieces that can reach the same square (Nbd2, R1e2)
         checc = ""
         takes = ""
         if self.piece_capt != "--":
@@ -341,10 +762,35 @@ class Move():
                 checc = "#"
             else:
                 checc = "+"
+        if self.is_castle:
+            return ("O-O" if self.end_col == 6 else "O-O-O") + checc
         if self.piece_moved[1] == "p":
-            return (takes + self.get_rank_file(self.end_row, self.end_col) + checc)
+            promotion = self.promotion
+            if takes:
+                takes = self.col_to_file[self.start_col] + takes
+            return (takes + self.get_rank_file(self.end_row, self.end_col) +
+                    ("=" + promotion[1] if promotion else "") + checc)
         else:
-            return (self.piece_moved[1] + takes + self.get_rank_file(self.end_row, self.end_col) + checc)
+            return (self.piece_moved[1] + self.disambiguation(legal) + takes +
+                    self.get_rank_file(self.end_row, self.end_col) + checc)
+
+    def disambiguation(self, legal): #file, rank or both of the start square when another piece of the same kind reaches the end square too
+        if not legal:
+            return ""
+        others = [m for m in legal if m.piece_moved == self.piece_moved and m.end_row == self.end_row and
+                  m.end_col == self.end_col and (m.start_row, m.start_col) != (self.start_row, self.start_col)]
+        if not others:
+            return ""
+        if all(m.start_col != self.start_col for m in others):
+            return self.col_to_file[self.start_col]
+        if all(m.start_row != self.start_row for m in others):
+            return self.row_to_rank[self.start_row]
+        return self.get_rank_file(self.start_row, self.start_col)
+
+    def get_uci(self): #e2e4 style (e7e8q for promotions), works for every move unlike get_notation which needs the position
+        name = self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
+        promotion = self.promotion
+        return name + promotion[1].lower() if promotion else name
 
     def get_rank_file(self, r, c):
         return self.col_to_file[c] + self.row_to_rank[r]
\ No newline at end of file
@@ -1,7 +1,20 @@
 """
 driver file, responsible for handling user input and displaying GameState object
+
+usage:
+    python ChessMain.py
+    python ChessMain.py --bench-startup 5 #time to first frame: old per piece scaling vs the sprite atlas
 """
 
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
 import pygame as pp
 import ChessEngine
 
@@ -9,36 +22,126 @@ width = height = 512
 dimension = 8
 square_size = height // dimension
 max_fps = 15 #buat animasi
-images = {}
+image_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images") #works from any working directory
+cache_dir = os.path.join(image_dir, "cache")
+pieces = ["bR", "bN", "bB", "bQ", "bK", "bp", "wp", "wQ", "wK", "wB", "wN", "wR"]
 
-"""
-Initialize a global dict of images, called exactly once in the main
-"""
-def load_images():
-    pieces = ["bR", "bN", "bB", "bQ", "bK", "bp", "wp", "wQ", "wK", "wB", "wN", "wR"]
-    for piece in pieces:
-        images[piece] = pp.transform.scale(pp.image.load("images/" + piece + ".png"), (square_size, square_size))
-    #we can access an image by calling the image dict
+class Sprites():
+    #the piece images at one square size, loaded on first use: images[piece] works like the old dict
+    #with an atlas the 12 pieces come already scaled from one png (cache_dir/atlas_<size>.png, side by side
+    #in the order of pieces), it is made from images/ the first time and again when one of them is newer
+    def __init__(self, size, use_atlas=True):
+        self.size = size
+        self.use_atlas = use_atlas
+        self.images = None
+        self.load_seconds = None
+        self.atlas_built = False
+
+    def __getitem__(self, piece):
+        if self.images is None:
+            self.load()
+        return self.images[piece]
+
+    def atlas_path(self):
+        return os.path.join(cache_dir, "atlas_%d.png" % self.size)
+
+    def load(self):
+        t = time.perf_counter()
+        if not self.use_atlas:
+            atlas = build_atlas(self.size)
+        elif atlas_fresh(self.atlas_path()):
+            atlas = pp.image.load(self.atlas_path())
+        else:
+            atlas = build_atlas(self.size)
+            save_atlas(atlas, self.atlas_path())
+            self.atlas_built = True
+        if pp.display.get_surface() is not None: #same pixel format as the screen, blits without conversion
+            atlas = atlas.convert_alpha()
+        size = self.size
+        self.images = {piece: atlas.subsurface(pp.Rect(i*size, 0, size, size)) for i, piece in enumerate(pieces)}
+        self.load_seconds = time.perf_counter() - t
+
+def build_atlas(size): #the old way, every png loaded and scaled, then put next to each other
+    atlas = pp.Surface((size * len(pieces), size), pp.SRCALPHA)
+    for i, piece in enumerate(pieces):
+        atlas.blit(pp.transform.scale(pp.image.load(os.path.join(image_dir, piece + ".png")), (size, size)), (i*size, 0))
+    return atlas
+
+def atlas_fresh(path):
+    try:
+        built = os.path.getmtime(path)
+    except OSError:
+        return False
+    return all(os.path.getmtime(os.path.join(image_dir, piece + ".png")) <= built for piece in pieces)
+
+def save_atlas(atlas, path): #best effort, a read only install just builds the atlas every launch
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = "%s.%d.png" % (path, os.getpid())
+        pp.image.save(atlas, tmp)
+        os.replace(tmp, path) #two launches at once never see half a file
+    except (OSError, pp.error):
+        pass
+
+images = Sprites(square_size)
 
 """
 code main driver, handles the user input
+the screen is only redrawn where something changed: the board background is drawn once into
+a surface, then every change (move, undo, selection) blits that surface back under the changed
+squares and updates only those rects. when nothing happens the loop sleeps in pp.event.wait
 """
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="play chess in a pygame window")
+    parser.add_argument("--bench-startup", type=int, default=0, metavar="RUNS",
+                        help="print the time to first frame of fresh processes as json instead of playing")
+    parser.add_argument("--first-frame", action="store_true", help=argparse.SUPPRESS) #one benchmark run
+    parser.add_argument("--no-atlas", action="store_true", help="load and scale every image at startup")
+    parser.add_argument("--cache-dir", default=None, help="where the sprite atlas is kept")
+    args = parser.parse_args(argv)
+    global cache_dir
+    if args.cache_dir:
+        cache_dir = args.cache_dir
+    if args.bench_startup:
+        json.dump(startup_benchmark(args.bench_startup), sys.stdout, indent=2)
+        print()
+        return 0
+    if args.no_atlas:
+        images.use_atlas = False
+    phases = {}
+    t = time.perf_counter()
     pp.init()
     screen = pp.display.set_mode((width, height))
     clock = pp.time.Clock()
-    screen.fill(pp.Color("white"))
-    gs = ChessEngine.GameState()
-    valid_moves = gs.get_valid_move()
+    board_surface = make_board_surface() #ini juga sekali aja
+    phases["display_ms"] = time.perf_counter() - t
     move_made = False #flag variable for when a valid move is made, supaya ga regenerate vmoves b4 player makes move
-    load_images() #sekali aja sblm while loop
     running = True #nandain kalo game udah jalan(??)
     selected_sq = () #keeping track of last click of user (row,col)
     player_click = [] #keep track of the player clicks, list of two tuples
+    t = time.perf_counter()
+    #the first frame is the start position parsed straight from the fen (no engine tables needed yet), drawing
+    #it loads the piece images and shown keeps what is on the screen for the partial redraws
+    shown = draw_game_state(screen, board_surface, ChessEngine.parse_fen(ChessEngine.start_fen)[0], selected_sq)
+    pp.display.flip()
+    phases["first_draw_ms"] = time.perf_counter() - t
+    first_frame_time = time.time()
+    #the window is up while the engine builds its tables and the first moves
+    t = time.perf_counter()
+    gs = ChessEngine.GameState(move_cache=ChessEngine.MoveCache(1024)) #undo/redo lands on positions we already generated
+    valid_moves = gs.get_valid_move()
+    phases["game_state_ms"] = time.perf_counter() - t
+    if args.first_frame:
+        report_first_frame(phases, first_frame_time)
+        pp.quit()
+        return 0
     while(running):
-        for e in pp.event.get():
+        redraw_all = False
+        for e in [pp.event.wait()] + pp.event.get(): #blocks until there is something to do
             if e.type == pp.QUIT:
                 running = False
+            elif e.type in expose_events: #window was covered/restored, the screen content is gone
+                redraw_all = True
             #mouse handler
             elif e.type == pp.MOUSEBUTTONDOWN:
                 location = pp.mouse.get_pos() #lokasi mouse (x,y)
@@ -64,41 +167,113 @@ def main():
                 if e.key == pp.K_z:
                     gs.undo_move()
                     move_made = True
+                    selected_sq = ()
+                    player_click = []
 
         if move_made:
             valid_moves = gs.get_valid_move()
-            print(move.get_notation(gs))
+            if gs.move_log: #after an undo this is the move before, still the last one played
+                print(gs.move_log[-1].get_notation(gs))
             if gs.checkmate:
-                winner = "White" if not gs.whiteToMove else "Black"
+                winner = "White" if not gs.white_to_move else "Black"
                 print ("The game is finished. The winner is " + winner + ". The game takes " + \
-                        str(len(gs.moveLog)) + " moves. Thanks for playing!")
+                        str(len(gs.move_log)) + " moves. Thanks for playing!")
+                running = False
+            elif gs.stalemate or gs.get_draw():
+                print("The game is finished. Draw by " + (gs.get_draw() or "stalemate") + ". Thanks for playing!")
                 running = False
             move_made = False
 
-        draw_game_state(screen, gs)
-        clock.tick(max_fps)
-        pp.display.flip()
+        if redraw_all:
+            shown = draw_game_state(screen, board_surface, gs.board, selected_sq)
+            pp.display.flip()
+        else:
+            rects = draw_changes(screen, board_surface, gs, selected_sq, shown)
+            if rects:
+                pp.display.update(rects)
+        clock.tick(max_fps) #cap for bursts of events, idle time is spent in event.wait
 
-#draws the square and board (graphics)
-def draw_game_state(screen, gs):
-    draw_board(screen) #gambar kotak
-    draw_pieces(screen, gs.board) #gambar pieces
+expose_events = {pp.VIDEOEXPOSE, getattr(pp, "WINDOWEXPOSED", pp.VIDEOEXPOSE)}
 
-#gambar papan
-def draw_board(screen):
+#gambar papan sekali ke surface sendiri, nanti tinggal di blit
+def make_board_surface():
+    surface = pp.Surface((width, height))
     colors = [pp.Color("white"), pp.Color("gray")]
     for r in range(dimension):
         for c in range(dimension):
             color = colors[(r+c)%2]
-            pp.draw.rect(screen, color, pp.Rect(c*square_size, r*square_size, square_size, square_size))
+            pp.draw.rect(surface, color, pp.Rect(c*square_size, r*square_size, square_size, square_size))
+    return surface
+
+#draws the whole board and pieces, returns what is shown: [copy of the board, selected square]
+def draw_game_state(screen, board_surface, board, selected_sq):
+    screen.blit(board_surface, (0, 0)) #gambar kotak
+    for r in range(dimension):
+        for c in range(dimension):
+            draw_square(screen, board_surface, board, r, c, selected_sq)
+    return [[row[:] for row in board], selected_sq]
 
-#gambar pieces pake GameState.board
-def draw_pieces(screen, board):
+#redraws only the squares that differ from what is shown, returns the rects to update
+def draw_changes(screen, board_surface, gs, selected_sq, shown):
+    shown_board, shown_selected = shown
+    dirty = set()
     for r in range(dimension):
         for c in range(dimension):
-            piece = board[r][c]
-            if piece != "--":
-                screen.blit(images[piece], pp.Rect(c*square_size, r*square_size, square_size, square_size))
+            if gs.board[r][c] != shown_board[r][c]:
+                dirty.add((r, c))
+                shown_board[r][c] = gs.board[r][c]
+    if selected_sq != shown_selected:
+        dirty.update(sq for sq in (selected_sq, shown_selected) if sq)
+    shown[:] = [shown_board, selected_sq]
+    return [draw_square(screen, board_surface, gs.board, r, c, selected_sq) for r, c in dirty]
+
+#satu kotak: background dari board_surface, highlight kalo dipilih, terus piecenya
+def draw_square(screen, board_surface, board, r, c, selected_sq):
+    rect = pp.Rect(c*square_size, r*square_size, square_size, square_size)
+    screen.blit(board_surface, rect, rect)
+    if selected_sq == (r, c):
+        pp.draw.rect(screen, pp.Color("lightblue"), rect)
+    piece = board[r][c]
+    if piece != "--":
+        screen.blit(images[piece], rect)
+    return rect
+
+#startup benchmark: every run is a new python process (imports included) with a dummy video driver
+
+def report_first_frame(phases, first_frame_time):
+    #one json line for startup_benchmark, the total counts from before the parent started the process
+    #to the flip of the first frame, game_state_ms (engine tables, first legal moves) comes after it,
+    #ready_ms is the total until the first click can be answered
+    report = {name: round(seconds * 1000, 3) for name, seconds in phases.items()}
+    report["sprites_ms"] = round(images.load_seconds * 1000, 3)
+    report["atlas_built"] = images.atlas_built
+    started = os.environ.get("CHESS_STARTUP_T0")
+    if started:
+        report["first_frame_ms"] = round((first_frame_time - float(started)) * 1000, 3)
+        report["ready_ms"] = round((time.time() - float(started)) * 1000, 3)
+    print(json.dumps(report))
+
+def first_frame(extra_args):
+    env = dict(os.environ, SDL_VIDEODRIVER="dummy", SDL_AUDIODRIVER="dummy", PYGAME_HIDE_SUPPORT_PROMPT="1")
+    env["CHESS_STARTUP_T0"] = repr(time.time())
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--first-frame"] + extra_args,
+                         env=env, stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def startup_benchmark(runs=5):
+    #median of runs fresh processes for: the old per piece load + scale ("scale"), the very first launch that
+    #builds the atlas ("atlas_cold") and every launch after it ("atlas_warm"), in a temporary cache dir
+    report = {"runs": runs, "square_size": square_size}
+    samples = {"scale": [], "atlas_cold": [], "atlas_warm": []}
+    for i in range(runs):
+        with tempfile.TemporaryDirectory() as cache:
+            samples["scale"].append(first_frame(["--no-atlas", "--cache-dir", cache]))
+            samples["atlas_cold"].append(first_frame(["--cache-dir", cache]))
+            samples["atlas_warm"].append(first_frame(["--cache-dir", cache]))
+    for mode, results in samples.items():
+        report[mode] = {key: round(statistics.median(r[key] for r in results), 3)
+                        for key in results[0] if key != "atlas_built"}
+    return report
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
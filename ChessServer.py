@@ -0,0 +1,387 @@
+"""
+headless game server: many GameState sessions behind one asyncio event loop
+protocol is json lines over tcp, one request per line and one response per line:
+    {"id": 1, "op": "new"}                                 -> {"id": 1, "ok": true, "game": "g1", "fen": ...}
+    {"id": 2, "op": "move", "game": "g1", "move": "e2e4"}  -> e2e4 style or san (Nf3, exd5)
+    {"id": 3, "op": "moves", "game": "g1"}                 -> legal moves in e2e4 style
+ops: new (optional fen), state, moves, move, undo, ai (depth/time), perft (depth, at most 4), close, stats
+responses carry the id of the request and can come back out of order (ai and perft run in the
+pool while other requests are answered), errors come back as {"ok": false, "error": ...}
+
+cheap requests run on the loop: legal moves come out of a ChessEngine.MoveCache shared by every
+session, so move validation is a dict lookup for positions seen before. the cpu heavy requests
+(ai search, perft) go to a process pool as a string so the loop never waits for them, the ai gets the
+position like the ParallelSearch workers (ParallelSearch.pack_position, with the moves since the last pawn
+move or capture so its search sees the repetitions of the game) and the pool is set up the same way
+(ParallelSearch.init_worker)
+"stats" returns p50/p90/p99/max latency in ms per op
+
+usage:
+    python ChessServer.py --port 8765 --workers 4
+    python ChessServer.py --port 8765 --bench 1000 #starts a server and plays 1000 random games against it
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import random
+import sys
+import time
+
+import ChessEngine
+import PGN
+import ParallelSearch
+
+max_ai_depth = 64
+max_ai_time = 10.0 #seconds, one request can not keep a pool worker longer
+max_perft_depth = 4
+max_perft_time = 10.0 #seconds, checked between the root moves, a wide position can still be slow at depth 4
+
+def pool_search(packed, depth, time_limit): #runs inside a worker, packed is from ParallelSearch.pack_position
+    gs = ParallelSearch.unpack_position(packed, ParallelSearch.worker_backend)
+    return ParallelSearch.worker_searcher.search(gs, time_limit, depth).as_dict()
+
+def pool_perft(fen, depth): #runs inside a worker
+    import Perft #only this request needs the perft counter
+    gs = ChessEngine.GameState(ParallelSearch.worker_backend)
+    gs.set_fen(fen)
+    t = time.perf_counter()
+    if depth <= 1:
+        nodes = Perft.perft(gs, depth)
+    else:
+        nodes = 0
+        for code in gs.get_valid_move_codes():
+            if time.perf_counter() - t > max_perft_time:
+                raise ValueError("perft depth %d ran out of its %g seconds" % (depth, max_perft_time))
+            gs.make_move_code(code)
+            nodes += Perft.perft(gs, depth - 1)
+            gs.undo_move()
+    return {"nodes": nodes, "seconds": round(time.perf_counter() - t, 6)}
+
+class RequestError(Exception):
+    pass
+
+class LatencyStats():
+    #last max_samples latencies per op, enough for stable percentiles without growing forever
+    def __init__(self, max_samples=10000):
+        self.samples = collections.defaultdict(lambda: collections.deque(maxlen=max_samples))
+        self.counts = collections.Counter()
+        self.errors = collections.Counter()
+
+    def add(self, op, seconds, ok=True):
+        self.samples[op].append(seconds)
+        self.counts[op] += 1
+        if not ok:
+            self.errors[op] += 1
+
+    def report(self):
+        report = {}
+        for op, samples in self.samples.items():
+            ordered = sorted(samples)
+            n = len(ordered)
+            report[op] = {"count": self.counts[op], "errors": self.errors[op],
+                          "p50_ms": round(ordered[n * 50 // 100] * 1000, 3),
+                          "p90_ms": round(ordered[min(n - 1, n * 90 // 100)] * 1000, 3),
+                          "p99_ms": round(ordered[min(n - 1, n * 99 // 100)] * 1000, 3),
+                          "max_ms": round(ordered[-1] * 1000, 3)}
+        return report
+
+class Session():
+    def __init__(self, game_id, gs):
+        self.game_id = game_id
+        self.gs = gs
+        self.lock = asyncio.Lock() #one request at a time changes or reads the position
+
+class ChessServer():
+    def __init__(self, workers=None, backend="board", max_sessions=100000, cache_size=1 << 16, tt_size=1 << 16):
+        self.backend = backend
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.ids = itertools.count(1)
+        self.move_cache = ChessEngine.MoveCache(cache_size)
+        self.latency = LatencyStats()
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+                                                           initializer=ParallelSearch.init_worker,
+                                                           initargs=(tt_size, backend))
+        self.server = None
+        self.connections = {} #writer -> task of handle_client
+        self.handlers = {"new": self.op_new, "state": self.op_state, "moves": self.op_moves, "move": self.op_move,
+                         "undo": self.op_undo, "ai": self.op_ai, "perft": self.op_perft, "close": self.op_close,
+                         "stats": self.op_stats}
+
+    async def start(self, host="127.0.0.1", port=8765):
+        self.server = await asyncio.start_server(self.handle_client, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for writer in list(self.connections): #ends the readline of every client, then let them finish
+            writer.close()
+        await asyncio.gather(*self.connections.values(), return_exceptions=True)
+        self.pool.shutdown()
+
+    async def handle_client(self, reader, writer):
+        tasks = set()
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.ensure_future(self.answer(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            del self.connections[writer]
+            writer.close()
+
+    async def answer(self, line, writer):
+        start = time.perf_counter()
+        op = "invalid"
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise RequestError("a request is a json object")
+            request_id = request.get("id")
+            op = request.get("op")
+            handler = self.handlers.get(op)
+            if handler is None:
+                op = "invalid"
+                raise RequestError("unknown op " + repr(request.get("op")))
+            response = await handler(request)
+            response["ok"] = True
+        except (RequestError, ValueError, TypeError) as e:
+            response = {"ok": False, "error": str(e)}
+        except Exception as e: #a bug in one request must not leave the client waiting forever
+            response = {"ok": False, "error": "internal error: %r" % e}
+        response["id"] = request_id
+        self.latency.add(op, time.perf_counter() - start, response["ok"])
+        if not writer.is_closing():
+            writer.write((json.dumps(response) + "\n").encode())
+            await writer.drain()
+
+    def session(self, request):
+        session = self.sessions.get(request.get("game"))
+        if session is None:
+            raise RequestError("unknown game " + repr(request.get("game")))
+        return session
+
+    def describe(self, session): #the common part of every per game response
+        gs = session.gs
+        gs.get_valid_move_codes() #sets in_check/checkmate/stalemate, cached after the first time
+        return {"game": session.game_id, "fen": gs.get_fen(), "white_to_move": gs.white_to_move,
+                "in_check": gs.in_check, "checkmate": gs.checkmate, "stalemate": gs.stalemate,
+                "draw": gs.get_draw()}
+
+    async def op_new(self, request):
+        if len(self.sessions) >= self.max_sessions:
+            raise RequestError("too many games")
+        gs = ChessEngine.GameState(self.backend, move_cache=self.move_cache)
+        if request.get("fen"):
+            try:
+                gs.set_fen(request["fen"])
+            except ValueError as e:
+                raise RequestError("invalid fen: %s" % e)
+        session = Session("g%d" % next(self.ids), gs)
+        self.sessions[session.game_id] = session
+        return self.describe(session)
+
+    async def op_state(self, request):
+        session = self.session(request)
+        async with session.lock:
+            return self.describe(session)
+
+    async def op_moves(self, request):
+        session = self.session(request)
+        async with session.lock:
+            response = self.describe(session)
+            response["moves"] = [move.get_uci() for move in session.gs.get_valid_move()]
+            return response
+
+    async def op_move(self, request):
+        session = self.session(request)
+        text = request.get("move")
+        if not isinstance(text, str):
+            raise RequestError("move is missing")
+        async with session.lock:
+            gs = session.gs
+            moves = gs.get_valid_move()
+            move = next((m for m in moves if m.get_uci() == text), None)
+            if move is None:
+                try:
+                    move = PGN.resolve_san(gs, text, moves)
+                except ValueError:
+                    raise RequestError("illegal move " + repr(text))
+            gs.make_move(move)
+            response = self.describe(session) #sets the check flags the notation reads
+            response["move"] = move.get_uci()
+            response["notation"] = move.get_notation(gs, moves)
+            return response
+
+    async def op_undo(self, request):
+        session = self.session(request)
+        async with session.lock:
+            if not session.gs.move_log:
+                raise RequestError("nothing to undo")
+            session.gs.undo_move()
+            return self.describe(session)
+
+    async def op_ai(self, request):
+        session = self.session(request)
+        depth = int(request.get("depth", max_ai_depth))
+        time_limit = float(request.get("time", 1.0))
+        if not 1 <= depth <= max_ai_depth:
+            raise RequestError("ai depth has to be in [1, %d]" % max_ai_depth)
+        if not 0 < time_limit <= max_ai_time:
+            raise RequestError("ai time has to be in (0, %g] seconds" % max_ai_time)
+        async with session.lock: #the search works on a snapshot, the game can go on meanwhile
+            fen = session.gs.get_fen()
+            packed = ParallelSearch.pack_position(session.gs)
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self.pool, pool_search, packed, depth, time_limit)
+        result["game"] = session.game_id
+        result["fen"] = fen
+        return result
+
+    async def op_perft(self, request):
+        session = self.session(request)
+        depth = int(request.get("depth", 3))
+        if not 0 <= depth <= max_perft_depth:
+            raise RequestError("perft depth has to be in [0, %d]" % max_perft_depth)
+        async with session.lock:
+            fen = session.gs.get_fen()
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self.pool, pool_perft, fen, depth)
+        result["game"] = session.game_id
+        result["fen"] = fen
+        return result
+
+    async def op_close(self, request):
+        session = self.session(request)
+        del self.sessions[session.game_id]
+        return {"game": session.game_id}
+
+    async def op_stats(self, request):
+        return {"sessions": len(self.sessions), "workers": self.workers, "move_cache": self.move_cache.stats(),
+                "latency": self.latency.report()}
+
+class ChessClient():
+    #minimal client for tests and benchmarks, several requests can be in flight on one connection
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.ids = itertools.count(1)
+        self.pending = {}
+        self.listener = None
+
+    async def connect(self, host="127.0.0.1", port=8765):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.listener = asyncio.ensure_future(self.listen())
+
+    async def listen(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            response = json.loads(line)
+            future = self.pending.pop(response.get("id"), None)
+            if future is not None and not future.done():
+                future.set_result(response)
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("server closed the connection"))
+
+    async def request(self, op, **args):
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        args["id"] = request_id
+        args["op"] = op
+        self.writer.write((json.dumps(args) + "\n").encode())
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        await self.listener
+
+async def play_random_game(client, rng, max_plies):
+    game = await client.request("new")
+    game_id = game["game"]
+    for i in range(max_plies):
+        moves = await client.request("moves", game=game_id)
+        if not moves["ok"] or not moves["moves"]:
+            break
+        reply = await client.request("move", game=game_id, move=rng.choice(moves["moves"]))
+        if not reply["ok"]:
+            break
+    await client.request("close", game=game_id)
+
+async def bench(games, connections=16, max_plies=40, workers=None, backend="board", seed=1):
+    #one server and `connections` clients in this process, `games` random games spread over the clients
+    server = ChessServer(workers, backend)
+    port = await server.start("127.0.0.1", 0)
+    clients = []
+    for i in range(connections):
+        client = ChessClient()
+        await client.connect("127.0.0.1", port)
+        clients.append(client)
+    rng = random.Random(seed)
+    t = time.perf_counter()
+    await asyncio.gather(*(play_random_game(clients[i % connections], random.Random(rng.random()), max_plies)
+                           for i in range(games)))
+    ai = await clients[0].request("new")
+    await clients[0].request("ai", game=ai["game"], depth=3, time=5.0)
+    seconds = time.perf_counter() - t
+    stats = await clients[0].request("stats")
+    for client in clients:
+        await client.close()
+    await server.close()
+    stats.pop("id", None)
+    stats.pop("ok", None)
+    stats.update({"games": games, "connections": connections, "seconds": round(seconds, 3)})
+    return stats
+
+async def serve(host, port, workers, backend):
+    server = ChessServer(workers, backend)
+    port = await server.start(host, port)
+    print("listening on %s:%d" % (host, port), file=sys.stderr)
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="json lines game server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None, help="pool processes for ai/perft, default: one per cpu")
+    parser.add_argument("--backend", default="board", choices=["board", "bitboard"])
+    parser.add_argument("--bench", type=int, default=0, help="play this many random games against a local server")
+    parser.add_argument("--connections", type=int, default=16, help="client connections for --bench")
+    args = parser.parse_args(argv)
+    if args.bench:
+        report = asyncio.run(bench(args.bench, args.connections, workers=args.workers, backend=args.backend))
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return 0
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.backend))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""
+endgame tables for king + queen or king + rook against a lone king (KQK, KRK)
+built locally by retrograde analysis with GameState's own move generator, stored as one byte per position
+    0 draw, 255 not a legal position, v in 1..254: the strong side mates, v - 1 plies from now
+no pawns so the board has 8 symmetries: the strong king is always moved into the a8-d8-d5 triangle
+(10 squares), a table is 2 (side to move) * 10 * 64 * 64 = 81920 bytes
+a probe is a few bitboard lookups and one byte read from the memory mapped file
+
+usage:
+    python EndgameTable.py --build KQK KRK --dir tables
+    python EndgameTable.py --probe --dir tables --fen "8/8/8/4k3/8/8/8/KQ6 w - - 0 1"
+"""
+
+import argparse
+import collections
+import json
+import mmap
+import os
+import sys
+import time
+
+import ChessEngine
+
+draw = 0
+illegal = 255
+table_pieces = {"KQK": "Q", "KRK": "R"}
+
+def transform(t, sq): #one of the 8 symmetries of the board (bit 0 mirror files, bit 1 mirror rows, bit 2 swap)
+    r, c = divmod(sq, 8)
+    if t & 1:
+        c = 7 - c
+    if t & 2:
+        r = 7 - r
+    if t & 4:
+        r, c = c, r
+    return r*8 + c
+
+triangle = [r*8 + c for r in range(4) for c in range(r, 4)] #a8-d8-d5, r <= c <= 3
+triangle_index = {sq: i for i, sq in enumerate(triangle)}
+#symmetry that brings a strong king on sq into the triangle, and the square tables of every symmetry
+canonical = [next(t for t in range(8) if transform(t, sq) in triangle_index) for sq in range(64)]
+transforms = [[transform(t, sq) for sq in range(64)] for t in range(8)]
+table_size = 2 * len(triangle) * 4096
+
+def index(strong_to_move, king, piece, weak_king): #squares are row*8 + col, any symmetry
+    t = transforms[canonical[king]]
+    return (((0 if strong_to_move else 1) * len(triangle) + triangle_index[t[king]]) * 64 + t[piece]) * 64 + t[weak_king]
+
+def kings_touch(a, b):
+    return abs(a // 8 - b // 8) <= 1 and abs(a % 8 - b % 8) <= 1
+
+def build(name, backend="bitboard"):
+    #retrograde analysis: start from the mates and walk the moves backwards, one ply further every round
+    #a weak side position is lost once every one of its moves leads to a strong side win
+    piece = table_pieces[name]
+    table = bytearray([illegal]) * table_size
+    predecessors = collections.defaultdict(list)
+    remaining = {} #weak side positions: moves not yet known to lose
+    queue = collections.deque()
+    gs = ChessEngine.GameState(backend)
+    empty = [["--"] * 8 for r in range(8)]
+    for strong_to_move in (True, False):
+        for king in triangle:
+            for piece_sq in range(64):
+                for weak_king in range(64):
+                    if piece_sq == king or weak_king in (king, piece_sq) or kings_touch(king, weak_king):
+                        continue
+                    board = [row[:] for row in empty]
+                    board[king // 8][king % 8] = "wK"
+                    board[piece_sq // 8][piece_sq % 8] = "w" + piece
+                    board[weak_king // 8][weak_king % 8] = "bK"
+                    try:
+                        gs.set_position(board, strong_to_move)
+                    except ValueError: #the side that just moved is in check
+                        continue
+                    i = index(strong_to_move, king, piece_sq, weak_king)
+                    table[i] = draw
+                    codes = gs.get_valid_move_codes()
+                    if not codes:
+                        if gs.checkmate:
+                            table[i] = 1
+                            queue.append(i)
+                        continue
+                    if not strong_to_move:
+                        remaining[i] = len(codes)
+                    for code in codes:
+                        start = code >> 6
+                        end = code & 63
+                        if start == king:
+                            successor = index(not strong_to_move, end, piece_sq, weak_king)
+                        elif start == piece_sq:
+                            successor = index(not strong_to_move, king, end, weak_king)
+                        elif end == piece_sq: #the lone king takes the piece, KK is a draw
+                            continue
+                        else:
+                            successor = index(not strong_to_move, king, piece_sq, end)
+                        predecessors[successor].append(i)
+    strong_half = len(triangle) * 4096 #indexes below this have the strong side to move
+    while queue:
+        i = queue.popleft()
+        value = table[i]
+        for p in predecessors[i]:
+            if table[p] != draw:
+                continue
+            if p < strong_half: #strong side to move: one winning move is enough
+                table[p] = value + 1
+                queue.append(p)
+            else:
+                remaining[p] -= 1
+                if remaining[p] == 0: #the last move to be resolved is the longest one, bfs order
+                    table[p] = value + 1
+                    queue.append(p)
+    return table
+
+def table_path(directory, name):
+    return os.path.join(directory, name + ".bin")
+
+class EndgameTable():
+    def __init__(self, path, piece):
+        self.path = path
+        self.piece = piece
+        self.file = open(path, "rb")
+        if os.fstat(self.file.fileno()).st_size != table_size:
+            self.file.close()
+            raise ValueError("%s is not an endgame table" % path)
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def probe_squares(self, strong_to_move, king, piece, weak_king): #raw byte, see the top of the file
+        return self.map[index(strong_to_move, king, piece, weak_king)]
+
+class EndgameTables():
+    #every table found in a directory, probe() picks the one that fits the material
+    def __init__(self, directory="tables"):
+        self.tables = {}
+        for name, piece in table_pieces.items():
+            path = table_path(directory, name)
+            if os.path.exists(path):
+                self.tables[piece] = EndgameTable(path, piece)
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def probe(self, gs):
+        #None if there is no table for this material, else (result, plies to mate) for the side to move
+        #result is "win", "loss" or "draw", a bare KK counts as a draw too
+        bb = gs.bitboards
+        count = bin(bb.occupied).count("1")
+        if count == 2:
+            return ("draw", None)
+        if count != 3:
+            return None
+        for piece, table in self.tables.items():
+            for strong, weak in (("w", "b"), ("b", "w")):
+                piece_bit = bb.pieces[strong + piece]
+                if piece_bit:
+                    king = bb.pieces[strong + "K"].bit_length() - 1
+                    weak_king = bb.pieces[weak + "K"].bit_length() - 1
+                    strong_to_move = (strong == "w") == gs.white_to_move
+                    value = table.probe_squares(strong_to_move, king, piece_bit.bit_length() - 1, weak_king)
+                    if value == illegal:
+                        return None
+                    if value == draw:
+                        return ("draw", None)
+                    return ("win" if strong_to_move else "loss", value - 1)
+        return None
+
+    def best_move(self, gs):
+        #(move code, result, plies to mate) of the best move by the tables, None if the tables do not cover gs
+        #win: the fastest mate, loss: the longest defence, draw: any move that keeps the draw
+        if self.probe(gs) is None:
+            return None
+        best = None
+        for code in gs.get_valid_move_codes():
+            gs.make_move_code(code)
+            after = self.probe(gs)
+            gs.undo_move()
+            if after is None:
+                continue
+            result, plies = after
+            if result == "loss": #for the opponent, so a win for us
+                rank = (2, -plies)
+            elif result == "draw":
+                rank = (1, 0)
+            else:
+                rank = (0, plies)
+            if best is None or rank > best[0]:
+                best = (rank, code, {"loss": "win", "draw": "draw", "win": "loss"}[result],
+                        None if plies is None else plies + 1)
+        if best is None:
+            return None
+        return best[1:]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="build or probe KQK/KRK endgame tables")
+    parser.add_argument("--build", nargs="+", choices=sorted(table_pieces), help="tables to build")
+    parser.add_argument("--dir", default="tables")
+    parser.add_argument("--backend", default="bitboard", choices=["board", "bitboard"])
+    parser.add_argument("--probe", action="store_true", help="look up --fen")
+    parser.add_argument("--fen", default="8/8/8/4k3/8/8/8/KQ6 w - - 0 1")
+    args = parser.parse_args(argv)
+    if args.build:
+        os.makedirs(args.dir, exist_ok=True)
+        report = []
+        for name in args.build:
+            t = time.perf_counter()
+            table = build(name, args.backend)
+            with open(table_path(args.dir, name), "wb") as f:
+                f.write(table)
+            wins = [v for v in table if v not in (draw, illegal)]
+            strong = table[:len(table) // 2]
+            report.append({"table": name, "bytes": len(table), "positions": sum(v != illegal for v in table),
+                           "wins": len(wins), "longest_mate_plies": max(v for v in strong if v != illegal) - 1,
+                           "seconds": round(time.perf_counter() - t, 3)})
+    elif args.probe:
+        gs = ChessEngine.GameState()
+        gs.set_fen(args.fen)
+        with EndgameTables(args.dir) as tables:
+            t = time.perf_counter()
+            result = tables.probe(gs)
+            seconds = time.perf_counter() - t
+            best = tables.best_move(gs)
+        report = {"fen": args.fen, "probe_us": round(seconds * 1e6, 2), "result": result}
+        if best is not None and best[0] is not None:
+            report["best_move"] = ChessEngine.Move.from_code(best[0], gs.board).get_uci()
+    else:
+        parser.print_help()
+        return 0
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+opening book: (position, move) counts from a pgn corpus in a sorted file of fixed size records
+one record is 12 bytes, big endian: zobrist key (8), move code (2), weight (2, number of games, capped)
+records are sorted by key, so all the moves of a position are next to each other and a lookup
+is a binary search over the memory mapped file: no move generation, no parsing, a few microseconds
+
+usage:
+    python OpeningBook.py --build games.pgn more_games.pgn.gz --out book.bin --plies 20
+    python OpeningBook.py --probe book.bin --fen "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b - - 0 1"
+"""
+
+import argparse
+import collections
+import json
+import struct
+import sys
+import time
+
+import ChessEngine
+import PGN
+import PositionFile
+
+record = struct.Struct(">QHH")
+key_format = struct.Struct(">Q")
+max_weight = 0xFFFF
+
+def count_moves(paths, max_plies=20, backend="bitboard"):
+    #Counter of (key, move code) over the first max_plies of every game, a game stops at its first unknown move
+    counts = collections.Counter()
+    games = 0
+    for path in paths:
+        stream = PGN.open_text(path)
+        try:
+            for game in PGN.read_games(stream):
+                games += 1
+                try:
+                    gs = game.start_position(backend)
+                except (ValueError, KeyError):
+                    continue
+                for san in game.moves[:max_plies]:
+                    try:
+                        move = PGN.resolve_san(gs, san)
+                    except ValueError:
+                        break
+                    counts[(gs.zobrist_key, move.move_ID)] += 1
+                    gs.make_move(move)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+    return counts, games
+
+def write_book(path, counts, min_count=1):
+    entries = sorted((key, code, min(n, max_weight)) for (key, code), n in counts.items() if n >= min_count)
+    with open(path, "wb") as f:
+        for entry in entries:
+            f.write(record.pack(*entry))
+    return len(entries)
+
+def build(paths, out, max_plies=20, min_count=1, backend="bitboard"):
+    t = time.perf_counter()
+    counts, games = count_moves(paths, max_plies, backend)
+    entries = write_book(out, counts, min_count)
+    return {"games": games, "positions": len({key for key, code in counts}), "records": entries,
+            "bytes": entries * record.size, "seconds": round(time.perf_counter() - t, 3)}
+
+class OpeningBook(PositionFile.RecordFile):
+    def __init__(self, path):
+        PositionFile.RecordFile.__init__(self, path, record.size, "book file")
+
+    def lookup(self, key): #[(move code, weight)] of the position with this zobrist key, [] if not in the book
+        data = self.view
+        size = record.size
+        lo = 0
+        hi = self.count
+        while lo < hi: #first record with a key >= key
+            mid = (lo + hi) >> 1
+            if key_format.unpack_from(data, mid * size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        moves = []
+        while lo < self.count:
+            entry_key, code, weight = record.unpack_from(data, lo * size)
+            if entry_key != key:
+                break
+            moves.append((code, weight))
+            lo += 1
+        return moves
+
+    def choose(self, gs, rng=None): #a book Move for gs, weighted random with rng, else the most played one
+        moves = self.lookup(gs.zobrist_key)
+        if moves: #a stale book or a key collision can hold a move that is not legal here, those are skipped
+            legal = set(gs.get_valid_move_codes())
+            moves = [m for m in moves if m[0] in legal]
+        if not moves:
+            return None
+        if rng is None:
+            code = max(moves, key=lambda m: m[1])[0]
+        else:
+            code = rng.choices([m[0] for m in moves], [m[1] for m in moves])[0]
+        return ChessEngine.Move.from_code(code, gs.board)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="build or probe an opening book")
+    parser.add_argument("--build", nargs="+", metavar="PGN", help="pgn files (.gz ok) to build the book from")
+    parser.add_argument("--out", default="book.bin")
+    parser.add_argument("--plies", type=int, default=20, help="only the first plies of every game go in")
+    parser.add_argument("--min-count", type=int, default=1, help="drop moves played fewer times")
+    parser.add_argument("--probe", metavar="BOOK", help="print the book moves of --fen")
+    parser.add_argument("--fen", default=ChessEngine.start_fen)
+    args = parser.parse_args(argv)
+    if args.build:
+        report = build(args.build, args.out, args.plies, args.min_count)
+    elif args.probe:
+        gs = ChessEngine.GameState()
+        gs.set_fen(args.fen)
+        with OpeningBook(args.probe) as book:
+            t = time.perf_counter()
+            moves = book.lookup(gs.zobrist_key)
+            seconds = time.perf_counter() - t
+        report = {"fen": args.fen, "lookup_us": round(seconds * 1e6, 2),
+                  "moves": [{"move": ChessEngine.Move.from_code(code, gs.board).get_uci(), "weight": weight}
+                            for code, weight in sorted(moves, key=lambda m: -m[1])]}
+    else:
+        parser.print_help()
+        return 0
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
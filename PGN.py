@@ -0,0 +1,142 @@
+"""
+streaming pgn reading and san resolution
+read_games yields one game at a time and reads the file line by line, so the size of the
+archive does not matter. comments, variations and nags are skipped
+resolve_san turns a san string into the matching Move of the current GameState
+"""
+
+import gzip
+import re
+import sys
+
+import ChessEngine
+
+result_tokens = ("1-0", "0-1", "1/2-1/2", "*")
+tag_re = re.compile(r'^\[(\w+)\s+"(.*)"\]$')
+move_number_re = re.compile(r'^\d+\.+')
+san_re = re.compile(r'^([KQRBN])?([a-h])?([1-8])?(x)?([a-h][1-8])(=[QRBN])?$')
+
+class PGNGame():
+    def __init__(self):
+        self.tags = {}
+        self.moves = [] #san strings
+        self.result = "*"
+
+    def start_position(self, backend="board"):
+        gs = ChessEngine.GameState(backend)
+        if "FEN" in self.tags:
+            gs.set_fen(self.tags["FEN"])
+        return gs
+
+def open_text(path): #plain or gzip, "-" is stdin
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+def read_games(stream): #stream is any iterable of lines (an open file, a gzip file, a list)
+    game = None
+    in_comment = False
+    variation_depth = 0
+    for line in stream:
+        line = line.strip()
+        if not line or line.startswith("%"):
+            continue
+        if not in_comment and variation_depth == 0 and line.startswith("["):
+            tag = tag_re.match(line)
+            if tag is not None:
+                if game is not None and game.moves: #a game without result token, the tags start the next one
+                    yield game
+                    game = None
+                if game is None:
+                    game = PGNGame()
+                game.tags[tag.group(1)] = tag.group(2)
+                continue
+        if game is None:
+            game = PGNGame()
+        i = 0
+        while i < len(line):
+            ch = line[i]
+            if in_comment:
+                end = line.find("}", i)
+                if end < 0:
+                    break
+                in_comment = False
+                i = end + 1
+                continue
+            if ch == "{":
+                in_comment = True
+                i += 1
+                continue
+            if ch == ";": #comment until the end of the line
+                break
+            if ch == "(":
+                variation_depth += 1
+                i += 1
+                continue
+            if ch == ")":
+                variation_depth = max(0, variation_depth - 1)
+                i += 1
+                continue
+            if ch.isspace():
+                i += 1
+                continue
+            j = i
+            while j < len(line) and not line[j].isspace() and line[j] not in "{}();":
+                j += 1
+            token = line[i:j]
+            i = j
+            if variation_depth > 0 or token.startswith("$"):
+                continue
+            if token in result_tokens:
+                game.result = token
+                yield game
+                game = None
+                continue
+            token = move_number_re.sub("", token)
+            if token:
+                if game is None:
+                    game = PGNGame()
+                game.moves.append(token)
+    if game is not None and (game.moves or game.tags):
+        yield game
+
+def read_fens(stream): #one fen (or epd, only the first 4 fields are used) per line
+    for line in stream:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line
+
+def resolve_san(gs, san, moves=None):
+    #the legal move written as san in the current position, ValueError if there is none or more than one
+    #matches on Move.get_notation without the start square (piece, capture, target square, promotion),
+    #the start square from Move.get_rank_file settles the disambiguation (Nbd2, R1e2, exd5)
+    san = san.rstrip("+#!?")
+    if moves is None:
+        moves = gs.get_valid_move()
+    if san in ("O-O", "O-O-O", "0-0", "0-0-0"):
+        core = san.replace("0", "O")
+        candidates = [move for move in moves if move.is_castle and move.get_notation(gs).rstrip("+#") == core]
+        if not candidates:
+            raise ValueError("castling is not legal here: " + san)
+        return candidates[0]
+    parsed = san_re.match(san)
+    if parsed is None:
+        raise ValueError("bad san: " + san)
+    piece, from_file, from_rank, capture, target, promotion = parsed.groups()
+    core = (piece or "") + (capture or "") + target + (promotion or "")
+    candidates = []
+    for move in moves:
+        notation = move.get_notation(gs).rstrip("+#")
+        if move.piece_moved[1] == "p" and move.piece_capt != "--":
+            notation = notation[1:] #exd5 -> xd5, the file of a pawn capture is checked below like any start square
+        if notation != core:
+            continue
+        start = move.get_rank_file(move.start_row, move.start_col)
+        if (from_file and start[0] != from_file) or (from_rank and start[1] != from_rank):
+            continue
+        candidates.append(move)
+    if len(candidates) != 1:
+        raise ValueError("%s matches %d legal moves" % (san, len(candidates)))
+    return candidates[0]
@@ -0,0 +1,234 @@
+"""
+multi core search: the root moves are split over a pool of worker processes
+(one python process per core, so the GIL is not in the way)
+workers get the position as a short string instead of a pickled GameState (with the moves since the
+last pawn move or capture, so they see repetitions and the 50 move rule), every
+worker keeps its own ChessAI.Searcher (and so its own transposition table) between tasks
+
+every iteration searches the best move so far first, the other root moves then run in parallel
+with a null window around its score and only the ones that beat it are searched again (pvs at the root)
+a time limit is an absolute deadline shared with the workers, queued moves are dropped when it passes
+
+with a fixed depth and no time limit the result only depends on the position, so workers=1 always gives
+the same move and score, more workers give the same score. the benchmark compares against ChessAI.Searcher
+
+usage:
+    python ParallelSearch.py --depth 4 --workers 4
+    python ParallelSearch.py --depth 4 --benchmark 1,2,4,8,16,32
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+
+import ChessAI
+import ChessEngine
+
+piece_to_char = {piece: ch for ch, piece in ChessEngine.fen_to_piece.items()}
+piece_to_char["--"] = "."
+char_to_piece = {ch: piece for piece, ch in piece_to_char.items()}
+
+def pack_position(gs):
+    #the position after the last pawn move or capture: 64 piece letters (row 0 first, "." for empty)
+    #+ "w"/"b" for the side to move + castling rights as one hex digit + en passant square as two digits
+    #(64 for none) + the halfmove clock, then the codes of the moves played since, separated by spaces
+    #positions before that can not come back, so replaying the moves gives the workers every repetition
+    #and the 50 move rule of the game
+    count = min(gs.halfmove, len(gs.move_log))
+    moves = gs.move_log[len(gs.move_log) - count:]
+    for move in moves:
+        gs.undo_move()
+    packed = "".join(piece_to_char[piece] for row in gs.board for piece in row) + \
+             ("w" if gs.white_to_move else "b") + "%x%02d%d" % (gs.castling, gs.en_passant, gs.halfmove)
+    for move in moves:
+        gs.make_move(move)
+    return " ".join([packed] + [str(move.move_ID) for move in moves])
+
+def unpack_position(packed, backend="board"):
+    fields = packed.split(" ")
+    position = fields[0]
+    board = [[char_to_piece[ch] for ch in position[r*8:r*8 + 8]] for r in range(8)]
+    gs = ChessEngine.GameState(backend)
+    gs.set_position(board, position[64] == "w", int(position[65], 16), int(position[66:68]), int(position[68:]))
+    for code in map(int, fields[1:]):
+        if code not in gs.get_valid_move_codes():
+            raise ValueError("illegal move %d in the history of %s" % (code, position))
+        gs.make_move_code(code)
+    return gs
+
+#state of a worker process, set once by init_worker
+worker_searcher = None
+worker_backend = "board"
+
+def init_worker(tt_size, backend):
+    global worker_searcher, worker_backend
+    worker_searcher = ChessAI.Searcher(tt_size)
+    worker_backend = backend
+
+def search_root_move(packed, move_ID, depth, alpha, beta, deadline): #runs inside a worker
+    if deadline is not None and time.time() >= deadline: #waited in the queue past the deadline
+        return {"move_ID": move_ID, "score": None, "depth": 0, "nodes": 0, "seconds": 0.0}
+    gs = unpack_position(packed, worker_backend)
+    if move_ID not in gs.get_valid_move_codes():
+        raise ValueError("move %d is not legal in %s" % (move_ID, packed))
+    t = time.perf_counter()
+    score, reached = worker_searcher.search_move(gs, move_ID, depth, alpha, beta, deadline)
+    return {"move_ID": move_ID, "score": score, "depth": reached,
+            "nodes": worker_searcher.nodes, "seconds": time.perf_counter() - t}
+
+class ParallelSearcher():
+    def __init__(self, workers=None, tt_size=1 << 16, backend="board"):
+        self.workers = workers or os.cpu_count() or 1
+        self.backend = backend
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                                           initargs=(tt_size, backend))
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def search(self, gs, time_limit=None, max_depth=4):
+        #iterative deepening over the whole root, every iteration is one search_depth over the pool
+        #the move of the last finished iteration is played, like in ChessAI.Searcher
+        start = time.perf_counter()
+        deadline = time.time() + time_limit if time_limit is not None else None
+        packed = pack_position(gs)
+        root_moves = sorted(gs.get_valid_move(), key=lambda m: m.move_ID) #fixed order, ties go to the first one
+        nodes = 0
+        best = None
+        if not root_moves:
+            return {"move": None, "score": -ChessAI.mate_score if gs.in_check else 0, "depth": 0,
+                    "nodes": 0, "seconds": 0.0, "nps": 0, "workers": self.workers}
+        order = [move.move_ID for move in root_moves]
+        scores = {}
+        for depth in range(1, max_depth + 1):
+            scores, exact, searched, finished = self.search_depth(packed, order, depth, deadline)
+            nodes += searched
+            if not finished:
+                if best is None and exact: #not even depth 1 finished, the moves that did finish it decide
+                    move_ID = max(order, key=lambda m: scores[m] if m in exact else -ChessAI.infinity)
+                    best = (scores[move_ID], move_ID, 0)
+                break
+            #best first, then by score (upper bounds for the moves that failed low), stable so ties keep their order
+            order.sort(key=lambda m: -scores[m])
+            best = (scores[order[0]], order[0], depth)
+            if abs(best[0]) >= ChessAI.mate_bound:
+                break
+        if best is None: #nothing finished at all, score the root moves with the static eval
+            best = self.static_best(gs, order)
+        seconds = time.perf_counter() - start
+        score, move_ID, depth = best
+        move = next(m for m in root_moves if m.move_ID == move_ID)
+        return {"move": move.get_uci(), "move_ID": move_ID, "score": score, "depth": depth,
+                "nodes": nodes, "seconds": round(seconds, 6), "nps": int(nodes / seconds) if seconds > 0 else 0,
+                "workers": self.workers}
+
+    def search_depth(self, packed, order, depth, deadline):
+        #one iteration, pvs at the root: order[0] (the best move so far) with the full window first, then
+        #every other move at once with the null window (alpha, alpha + 1) around its score, a move that beats
+        #it is searched again with (alpha, infinity). alpha stays the score of order[0], so which move wins
+        #does not depend on the order the workers finish in
+        #returns (scores, exact, nodes, finished), scores of moves not in exact are upper bounds
+        infinity = ChessAI.infinity
+        scores = {}
+        exact = set()
+        nodes = 0
+        alpha = None
+        pending = {self.pool.submit(search_root_move, packed, order[0], depth, -infinity, infinity, deadline): "full"}
+        while pending:
+            timeout = max(0.0, deadline - time.time()) if deadline is not None else None
+            done, not_done = concurrent.futures.wait(pending, timeout, concurrent.futures.FIRST_COMPLETED)
+            if not done: #deadline, the queued tasks are dropped, the running ones stop at it by themselves
+                for future in not_done:
+                    future.cancel()
+                for future in not_done:
+                    if not future.cancelled():
+                        nodes += future.result()["nodes"]
+                return scores, exact, nodes, False
+            for future in done:
+                window = pending.pop(future)
+                result = future.result()
+                nodes += result["nodes"]
+                if result["depth"] < depth: #ran out of time in the middle of the move
+                    continue
+                move_ID = result["move_ID"]
+                score = result["score"]
+                if window == "null" and score > alpha:
+                    pending[self.pool.submit(search_root_move, packed, move_ID, depth, alpha, infinity, deadline)] = "full"
+                    continue
+                scores[move_ID] = score
+                if window == "full":
+                    exact.add(move_ID)
+                if alpha is None: #order[0] is done, now the rest
+                    alpha = score
+                    for other in order[1:]:
+                        pending[self.pool.submit(search_root_move, packed, other, depth, alpha, alpha + 1, deadline)] = "null"
+        if len(scores) < len(order):
+            return scores, exact, nodes, False
+        #the first move with the highest exact score goes to the front
+        best = max((m for m in order if m in exact), key=lambda m: scores[m])
+        order.remove(best)
+        order.insert(0, best)
+        return scores, exact, nodes, True
+
+    def static_best(self, gs, order): #(score, move_ID, 0) of the root move with the best static eval
+        best = None
+        for move_ID in order:
+            gs.make_move_code(move_ID)
+            score = -ChessAI.evaluate(gs)
+            gs.undo_move()
+            if best is None or score > best[0]:
+                best = (score, move_ID, 0)
+        return best
+
+def benchmark(fen, depth, worker_counts, backend="board", tt_size=1 << 16):
+    #same fixed depth search with every worker count, speedup is against ChessAI.Searcher (one process,
+    #alpha-beta over the whole root) at the same depth, not against the pool with one worker
+    gs = ChessEngine.GameState(backend)
+    gs.set_fen(fen)
+    sequential = ChessAI.Searcher(tt_size).search(gs, None, depth)
+    base = {"move": sequential.move.get_uci() if sequential.move else None, "score": sequential.score,
+            "depth": sequential.depth, "nodes": sequential.nodes, "seconds": round(sequential.seconds, 6),
+            "nps": sequential.nps, "workers": 0}
+    report = [base]
+    for workers in worker_counts:
+        with ParallelSearcher(workers, tt_size, backend) as searcher:
+            result = searcher.search(gs, None, depth)
+        report.append(result)
+    for result in report:
+        result["speedup"] = round(base["seconds"] / result["seconds"], 3) if result["seconds"] > 0 else None
+        result["same_score"] = result["score"] == base["score"]
+        result["same_move"] = result["move"] == base["move"]
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="root splitting search over a process pool")
+    parser.add_argument("--fen", default=ChessEngine.start_fen)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--time", type=float, default=None, help="time budget in seconds")
+    parser.add_argument("--workers", type=int, default=None, help="default: one per cpu")
+    parser.add_argument("--backend", default="board", choices=["board", "bitboard"])
+    parser.add_argument("--benchmark", default=None, help="comma separated worker counts, e.g. 1,2,4,8")
+    args = parser.parse_args(argv)
+    if args.benchmark:
+        counts = [int(n) for n in args.benchmark.split(",")]
+        report = benchmark(args.fen, args.depth, counts, args.backend)
+    else:
+        gs = ChessEngine.GameState(args.backend)
+        gs.set_fen(args.fen)
+        with ParallelSearcher(args.workers, backend=args.backend) as searcher:
+            report = searcher.search(gs, args.time, args.depth)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
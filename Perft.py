@@ -0,0 +1,249 @@
+"""
+perft: counts the leaf nodes of the move tree to a fixed depth
+used both as a correctness check for GameState.get_valid_move (the counts of the
+reference positions are known) and as a benchmark (nodes/sec per depth)
+results are printed as json so they can be diffed / stored by other tools
+
+usage:
+    python Perft.py --depth 4
+    python Perft.py --fen "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1" --depth 2 --divide
+    python Perft.py --suite --backend bitboard
+    python Perft.py --suite --compare #run both backends and check they agree
+    python Perft.py --suite --max-depth 3 #the quick version, stops every position at depth 3
+    python Perft.py --depth 4 --move-cache 100000 #same counts, plus the hit rate of the legal move cache
+    python Perft.py --depth 4 --memory #plus the peak python allocation of every depth (an extra traced run)
+    python Perft.py --bench-attacks --depth 3 #king safety: full ray rescans vs the attack map
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import ChessEngine
+
+start_fen = ChessEngine.start_fen
+
+#standard perft positions, counts from the chessprogramming wiki
+#kiwipete and positions 4 and 5 are full of castling, en passant and promotions
+reference_positions = [
+    {"name": "start", "fen": start_fen,
+     "nodes": {1: 20, 2: 400, 3: 8902, 4: 197281}},
+    {"name": "kiwipete", "fen": "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     "nodes": {1: 48, 2: 2039, 3: 97862, 4: 4085603}},
+    {"name": "position 3", "fen": "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     "nodes": {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}},
+    {"name": "position 4", "fen": "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     "nodes": {1: 6, 2: 264, 3: 9467, 4: 422333}},
+    {"name": "position 5", "fen": "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     "nodes": {1: 44, 2: 1486, 3: 62379, 4: 2103487}},
+    {"name": "position 6", "fen": "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     "nodes": {1: 46, 2: 2079, 3: 89890}},
+]
+
+def load_position(fen, backend="board", move_cache=None):
+    gs = ChessEngine.GameState(backend, move_cache=move_cache)
+    gs.set_fen(fen)
+    return gs
+
+def perft(gs, depth):
+    if depth <= 0:
+        return 1
+    codes = gs.get_valid_move_codes() #no Move objects below the root, only ints
+    if depth == 1:
+        return len(codes)
+    nodes = 0
+    for code in codes:
+        gs.make_move_code(code)
+        nodes += perft(gs, depth - 1)
+        gs.undo_move()
+    return nodes
+
+def divide(gs, depth): #node count below every root move
+    if depth < 1:
+        raise ValueError("divide needs depth >= 1, got %d" % depth)
+    counts = {}
+    for move in gs.get_valid_move():
+        gs.make_move(move)
+        counts[move.get_uci()] = perft(gs, depth - 1)
+        gs.undo_move()
+    return counts
+
+def peak_alloc_kb(gs, depth):
+    #peak of the python allocations made while perft runs to depth, tracemalloc makes perft ~10x slower
+    #so this is a second run next to the timed one
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    perft(gs, depth)
+    peak = tracemalloc.get_traced_memory()[1] - before
+    if started:
+        tracemalloc.stop()
+    return round(peak / 1024, 3)
+
+def run(fen, max_depth, backend="board", expected=None, min_depth=1, move_cache=None, memory=False):
+    #runs perft for every depth in [min_depth, max_depth], returns a list of result dicts
+    #with a ChessEngine.MoveCache the cache counters after each depth are in the result too
+    #with memory the peak allocation of each depth is in the result too (peak_alloc_kb)
+    gs = load_position(fen, backend, move_cache)
+    results = []
+    for depth in range(min_depth, max_depth + 1):
+        t = time.perf_counter()
+        nodes = perft(gs, depth)
+        wall = time.perf_counter() - t
+        result = {"fen": fen, "backend": backend, "depth": depth, "nodes": nodes,
+                  "seconds": round(wall, 6), "nps": int(nodes / wall) if wall > 0 else None}
+        if memory:
+            result["peak_alloc_kb"] = peak_alloc_kb(gs, depth)
+        if expected is not None and depth in expected:
+            result["expected"] = expected[depth]
+            result["ok"] = nodes == expected[depth]
+        if move_cache is not None:
+            result["move_cache"] = move_cache.stats()
+        results.append(result)
+    return results
+
+def run_suite(backend="board", max_depth=None, memory=False):
+    results = []
+    for position in reference_positions:
+        depth = max(position["nodes"])
+        if max_depth is not None:
+            depth = min(depth, max_depth)
+        for result in run(position["fen"], depth, backend, position["nodes"], memory=memory):
+            result["name"] = position["name"]
+            results.append(result)
+    return results
+
+def compare(fen, depth, backends=("board", "bitboard")):
+    #divide with every backend, reports the root moves where the counts differ
+    counts = {}
+    for backend in backends:
+        counts[backend] = divide(load_position(fen, backend), depth)
+    reference = counts[backends[0]]
+    mismatches = {}
+    for backend in backends[1:]:
+        for name in set(reference) | set(counts[backend]):
+            if reference.get(name) != counts[backend].get(name):
+                mismatches.setdefault(name, {b: counts[b].get(name) for b in backends})
+    return {"fen": fen, "depth": depth, "nodes": {b: sum(counts[b].values()) for b in backends},
+            "ok": not mismatches, "mismatches": mismatches}
+
+def collect_positions(gs, depth, positions, limit):
+    #copies of the positions in the perft tree (before the move generator runs on them)
+    if len(positions) >= limit:
+        return
+    copy = ChessEngine.GameState(gs.backend)
+    copy.set_position(gs.board, gs.white_to_move, gs.castling, gs.en_passant, gs.halfmove)
+    positions.append(copy)
+    if depth == 0:
+        return
+    for code in gs.get_valid_move_codes():
+        gs.make_move_code(code)
+        collect_positions(gs, depth - 1, positions, limit)
+        gs.undo_move()
+
+def king_safety_rescan(gs): #the old way: one ray scan for checks/pins + one more per king target square
+    in_check, pins, checks = gs.rescan_pin_check()
+    if gs.white_to_move:
+        r, c = gs.white_king_location
+    else:
+        r, c = gs.black_king_location
+    ally = gs.board[r][c][0]
+    safe = 0
+    for d in ((-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)):
+        end_row = r + d[0]
+        end_col = c + d[1]
+        if 0 <= end_row < 8 and 0 <= end_col < 8 and gs.board[end_row][end_col][0] != ally:
+            if ally == "w":
+                gs.white_king_location = (end_row, end_col)
+            else:
+                gs.black_king_location = (end_row, end_col)
+            if not gs.rescan_pin_check()[0]:
+                safe += 1
+            if ally == "w":
+                gs.white_king_location = (r, c)
+            else:
+                gs.black_king_location = (r, c)
+    return safe
+
+def king_safety_attack_map(gs): #the new way: build the attack map once, then one bit test per square
+    gs.attack_info = None
+    info = gs.get_attack_info()
+    r, c = divmod(info.king_square, 8)
+    ally = gs.board[r][c][0]
+    safe = 0
+    for d in ((-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)):
+        end_row = r + d[0]
+        end_col = c + d[1]
+        if 0 <= end_row < 8 and 0 <= end_col < 8 and gs.board[end_row][end_col][0] != ally:
+            if not info.is_attacked(end_row*8 + end_col):
+                safe += 1
+    return safe
+
+def bench_attacks(fen, depth, limit=5000, repeat=5):
+    #per node cost of answering checks, pins and king safety, best of repeat runs
+    positions = []
+    collect_positions(load_position(fen), depth, positions, limit)
+    report = {"fen": fen, "depth": depth, "positions": len(positions)}
+    for name, fn in (("rescan", king_safety_rescan), ("attack_map", king_safety_attack_map)):
+        best = None
+        for i in range(repeat):
+            t = time.perf_counter()
+            for gs in positions:
+                fn(gs)
+            wall = time.perf_counter() - t
+            best = wall if best is None else min(best, wall)
+        report[name + "_us_per_node"] = round(best / len(positions) * 1e6, 3)
+    if sum(king_safety_rescan(gs) != king_safety_attack_map(gs) for gs in positions):
+        raise AssertionError("attack map and rescan disagree")
+    report["speedup"] = round(report["rescan_us_per_node"] / report["attack_map_us_per_node"], 2)
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="perft node counts and move generator benchmark")
+    parser.add_argument("--fen", default=start_fen)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--backend", default="board", choices=["board", "bitboard"])
+    parser.add_argument("--divide", action="store_true", help="node count per root move")
+    parser.add_argument("--suite", action="store_true", help="run the reference positions")
+    parser.add_argument("--max-depth", type=int, default=None, help="with --suite, stop every position at this depth")
+    parser.add_argument("--compare", action="store_true", help="check every backend gives the same counts")
+    parser.add_argument("--move-cache", type=int, default=0, help="size of a legal move cache, 0 = off")
+    parser.add_argument("--bench-attacks", action="store_true", help="per node cost of king safety checks")
+    parser.add_argument("--memory", action="store_true", help="peak python allocation per depth, traced separately")
+    args = parser.parse_args(argv)
+    if args.depth < 1 and (args.divide or args.compare):
+        parser.error("--divide and --compare need --depth >= 1")
+
+    if args.bench_attacks:
+        report = bench_attacks(args.fen, args.depth)
+        ok = True
+    elif args.suite and args.compare:
+        report = [compare(p["fen"], min(max(p["nodes"]), args.max_depth or 99)) for p in reference_positions]
+        ok = all(r["ok"] for r in report)
+    elif args.suite:
+        report = run_suite(args.backend, args.max_depth, args.memory)
+        ok = all(r.get("ok", True) for r in report)
+    elif args.compare:
+        report = compare(args.fen, args.depth)
+        ok = report["ok"]
+    elif args.divide:
+        gs = load_position(args.fen, args.backend)
+        t = time.perf_counter()
+        counts = divide(gs, args.depth)
+        report = {"fen": args.fen, "backend": args.backend, "depth": args.depth, "moves": counts,
+                  "nodes": sum(counts.values()), "seconds": round(time.perf_counter() - t, 6)}
+        ok = True
+    else:
+        move_cache = ChessEngine.MoveCache(args.move_cache) if args.move_cache else None
+        report = run(args.fen, args.depth, args.backend, move_cache=move_cache, memory=args.memory)
+        ok = True
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""
+compact binary position format for bulk storage
+one position is 32 bytes: 64 squares x 4 bits, square 0 (a8, board[0][0]) is the high nibble of byte 0,
+square 1 the low nibble of byte 0 and so on, same square order as GameState.board
+nibble codes:
+    0 empty, 1-6 white p N B R Q K, 7-12 black p N B R Q K
+    13 rook that can still castle (color from its rank), 14 pawn that can be taken en passant (the side
+    not to move), 15 black king with black to move, so castling, en passant and the side to move need no extra byte
+a position file is just records back to back (no header), record i starts at byte 32*i
+PositionFile maps the file with mmap and only decodes the record that is asked for
+
+usage:
+    python PositionFile.py --pack positions.fen positions.pos
+    python PositionFile.py --dump positions.pos --index 12345
+"""
+
+import argparse
+import json
+import mmap
+import os
+import sys
+
+import Bitboard
+import ChessEngine
+import PGN
+
+record_size = 32
+code_to_piece = ["--", "wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK", None, None, "bK"]
+piece_to_code = {piece: code for code, piece in enumerate(code_to_piece[:13])}
+castling_rook = 13
+en_passant_pawn = 14
+black_king_to_move = 15
+#corner square -> castling right of its rook
+rook_rights = {56: Bitboard.castle_white_queen, 63: Bitboard.castle_white_king,
+               0: Bitboard.castle_black_queen, 7: Bitboard.castle_black_king}
+
+#byte -> (piece of the even square, piece of the odd square), so decoding is one lookup per 2 squares
+byte_to_pieces = [(code_to_piece[b >> 4], code_to_piece[b & 15]) for b in range(256)]
+
+def encode(board, white_to_move, castling=0, en_passant=Bitboard.no_en_passant):
+    #8x8 board like GameState.board (castling rights and en passant square like GameState) -> 32 bytes
+    codes = [piece_to_code[piece] for row in board for piece in row]
+    for sq, right in rook_rights.items():
+        if castling & right:
+            codes[sq] = castling_rook
+    if en_passant != Bitboard.no_en_passant: #the pawn that jumped over the square
+        codes[en_passant + 8 if white_to_move else en_passant - 8] = en_passant_pawn
+    if not white_to_move:
+        if codes.count(piece_to_code["bK"]) != 1:
+            raise ValueError("black to move needs exactly one black king")
+        codes[codes.index(piece_to_code["bK"])] = black_king_to_move
+    return bytes(codes[i] << 4 | codes[i + 1] for i in range(0, 64, 2))
+
+def decode(data):
+    #32 bytes (bytes, bytearray or memoryview) -> (board, white_to_move, castling rights, en passant square)
+    if len(data) != record_size:
+        raise ValueError("a position is %d bytes, got %d" % (record_size, len(data)))
+    squares = []
+    for b in data:
+        squares.extend(byte_to_pieces[b])
+    white_to_move = all((b >> 4) != black_king_to_move and (b & 15) != black_king_to_move for b in data)
+    castling = 0
+    en_passant = Bitboard.no_en_passant
+    if None in squares: #castling rooks and en passant pawns, only a few records have them
+        pawn_row = 3 if white_to_move else 4
+        for sq, piece in enumerate(squares):
+            if piece is not None:
+                continue
+            code = (data[sq >> 1] >> (0 if sq & 1 else 4)) & 15
+            if code == castling_rook and sq in rook_rights:
+                squares[sq] = "wR" if sq >= 56 else "bR"
+                castling |= rook_rights[sq]
+            elif code == en_passant_pawn and en_passant == Bitboard.no_en_passant and sq // 8 == pawn_row:
+                squares[sq] = "bp" if white_to_move else "wp"
+                en_passant = sq - 8 if white_to_move else sq + 8
+            else:
+                raise ValueError("nibble code %d on square %d" % (code, sq))
+    return [squares[r*8:r*8 + 8] for r in range(8)], white_to_move, castling, en_passant
+
+def encode_state(gs):
+    return encode(gs.board, gs.white_to_move, gs.castling, gs.en_passant)
+
+def decode_state(data, backend="board"):
+    gs = ChessEngine.GameState(backend)
+    gs.set_position(*decode(data))
+    return gs
+
+def write_positions(path, states): #states is any iterable of GameState, returns how many were written
+    count = 0
+    with open(path, "wb") as f:
+        for gs in states:
+            f.write(encode_state(gs))
+            count += 1
+    return count
+
+class RecordFile():
+    #read only memory map of a file of fixed size records (no header), self.view is the whole file without a copy
+    #the records stay in the page cache instead of python objects, OpeningBook reads its book file with this too
+    def __init__(self, path, size_of_record, kind="record file"):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size % size_of_record:
+            self.file.close()
+            raise ValueError("%s is not a %s (size %d)" % (path, kind, size))
+        self.count = size // size_of_record
+        #mmap cannot map an empty file
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.view = memoryview(self.map) if size else memoryview(b"")
+
+    def close(self):
+        self.view.release()
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+class PositionFile(RecordFile):
+    #read only random access to a position file
+    def __init__(self, path):
+        RecordFile.__init__(self, path, record_size, "position file")
+
+    def record(self, i): #the raw 32 bytes of position i, a view into the mapping (no copy)
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("position %d out of range" % i)
+        return self.view[i*record_size:(i + 1)*record_size]
+
+    def __getitem__(self, i): #(board, white_to_move, castling, en_passant)
+        return decode(self.record(i))
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def load(self, i, backend="board"): #position i as a GameState
+        return decode_state(self.record(i), backend)
+
+def pack_fens(fen_path, out_path, backend="board"):
+    def states():
+        with open(fen_path, "r") as f:
+            for fen in PGN.read_fens(f):
+                gs = ChessEngine.GameState(backend)
+                gs.set_fen(fen)
+                yield gs
+    count = write_positions(out_path, states())
+    fen_bytes = os.path.getsize(fen_path)
+    return {"positions": count, "bytes": count * record_size, "bytes_per_position": record_size,
+            "fen_bytes_per_position": round(fen_bytes / count, 2) if count else None}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="32 byte binary positions")
+    parser.add_argument("--pack", nargs=2, metavar=("FEN_FILE", "POS_FILE"), help="one fen per line -> position file")
+    parser.add_argument("--dump", metavar="POS_FILE", help="print positions of a position file as fen")
+    parser.add_argument("--index", type=int, default=None, help="with --dump, only this position")
+    args = parser.parse_args(argv)
+    if args.pack:
+        json.dump(pack_fens(*args.pack), sys.stdout, indent=2)
+        print()
+    elif args.dump:
+        with PositionFile(args.dump) as positions:
+            indices = range(len(positions)) if args.index is None else [args.index]
+            for i in indices:
+                print(positions.load(i).get_fen())
+    else:
+        parser.print_help()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""
+opt-in profiling of the move generator
+nothing in ChessEngine changes: attach() puts timing wrappers on one GameState instance (its methods,
+its move_functions entries and its bitboards), enable() counts Move allocations on the class,
+a GameState that is not attached runs the normal code, so the cost when profiling is off is zero
+
+collected per function: calls, total and self time, and every call stack as a flamegraph collapsed
+stack line ("get_valid_move_codes;get_possible_moves;get_pawn_moves 1234", value in microseconds)
+plus: moves produced per piece generator, moves rejected by the check filter, Move objects allocated,
+attack map / check_pin_check calls per node, and the slowest nodes with their fen and position type
+
+usage:
+    python Profiler.py --depth 3 --json profile.json --collapsed profile.folded
+    flamegraph.pl profile.folded > profile.svg
+"""
+
+import argparse
+import collections
+import heapq
+import json
+import sys
+import time
+
+import ChessEngine
+import Perft
+
+#methods of GameState that get a timing wrapper, move_functions are wrapped separately
+wrapped_methods = ["get_valid_move", "get_valid_move_codes", "generate_move_codes", "get_valid_move_board",
+                   "get_possible_moves", "get_attack_info", "check_pin_check", "make_move", "undo_move"]
+wrapped_bitboard_methods = ["get_valid_move", "attack_info"]
+#the special moves are appended by the bitboards for both backends, counted like the piece generators
+wrapped_bitboard_generators = ["castle_moves", "en_passant_moves"]
+
+class Profiler():
+    def __init__(self, slowest=10):
+        self.calls = collections.Counter()
+        self.total = collections.defaultdict(float)
+        self.self_time = collections.defaultdict(float)
+        self.stacks = collections.defaultdict(float) #"a;b;c" -> self time in seconds
+        self.stack = [] #[name, start, time spent in children]
+        self.generated = collections.Counter() #moves appended by every piece generator
+        self.rejected = 0 #moves the check filter of get_valid_move_board threw away
+        self.allocations = collections.Counter() #Move objects created, per stack
+        self.node_types = collections.defaultdict(lambda: [0, 0.0]) #position type -> [nodes, seconds]
+        self.slowest = [] #heap of (seconds, fen, type)
+        self.keep_slowest = slowest
+        self.attached = {}
+        self.generator_names = set()
+        self.move_patch = None
+
+    #collecting
+
+    def enter(self, name):
+        self.stack.append([name, time.perf_counter(), 0.0])
+
+    def leave(self):
+        name, start, children = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        key = ";".join(frame[0] for frame in self.stack) + (";" if self.stack else "") + name
+        self.calls[name] += 1
+        self.total[name] += elapsed
+        self.self_time[name] += elapsed - children
+        self.stacks[key] += elapsed - children
+        if self.stack:
+            self.stack[-1][2] += elapsed
+        return elapsed
+
+    def timed(self, name, fn):
+        def wrapper(*args, **kwargs):
+            self.enter(name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.leave()
+        return wrapper
+
+    def timed_generator(self, name, fn): #piece generators get (r, c, moves) and append to moves (en passant, castling too)
+        def wrapper(r, c, moves):
+            before = len(moves)
+            self.enter(name)
+            try:
+                return fn(r, c, moves)
+            finally:
+                self.leave()
+                if not (self.stack and self.stack[-1][0] in self.generator_names): #queen calls rook and bishop
+                    self.generated[name] += len(moves) - before
+        return wrapper
+
+    def timed_board_filter(self, fn): #rejections = what the generators produced - what is left after the filter
+        def wrapper(info):
+            before = sum(self.generated.values())
+            self.enter("get_valid_move_board")
+            try:
+                moves = fn(info)
+            finally:
+                self.leave()
+            self.rejected += sum(self.generated.values()) - before - len(moves)
+            return moves
+        return wrapper
+
+    def timed_node(self, gs, fn): #get_valid_move_codes, once per node, also classified by position type
+        def wrapper():
+            self.enter("get_valid_move_codes")
+            try:
+                moves = fn()
+            finally:
+                seconds = self.leave()
+            kind = position_type(gs)
+            self.node_types[kind][0] += 1
+            self.node_types[kind][1] += seconds
+            if len(self.slowest) < self.keep_slowest:
+                heapq.heappush(self.slowest, (seconds, gs.get_fen(), kind))
+            elif seconds > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (seconds, gs.get_fen(), kind))
+            return moves
+        return wrapper
+
+    #switching on and off
+
+    def attach(self, gs): #wraps the methods of one GameState, detach() undoes it
+        if id(gs) in self.attached:
+            return gs
+        self.attached[id(gs)] = (gs, dict(gs.move_functions))
+        for name in wrapped_methods:
+            fn = getattr(gs, name)
+            if name == "get_valid_move_codes":
+                wrapper = self.timed_node(gs, fn)
+            elif name == "get_valid_move_board":
+                wrapper = self.timed_board_filter(fn)
+            else:
+                wrapper = self.timed(name, fn)
+            setattr(gs, name, wrapper)
+        for kind, fn in list(gs.move_functions.items()):
+            #the same wrapper in move_functions and on the instance, get_king_moves is also called directly
+            wrapper = self.timed_generator(fn.__name__, fn)
+            self.generator_names.add(fn.__name__)
+            gs.move_functions[kind] = wrapper
+            setattr(gs, fn.__name__, wrapper)
+        self.attach_bitboards(gs)
+        set_position = gs.set_position
+        def reset(*args): #set_position makes new bitboards, they need the wrappers too
+            set_position(*args)
+            self.attach_bitboards(gs)
+        gs.set_position = reset
+        return gs
+
+    def attach_bitboards(self, gs):
+        for name in wrapped_bitboard_methods + wrapped_bitboard_generators:
+            gs.bitboards.__dict__.pop(name, None)
+            fn = getattr(gs.bitboards, name)
+            if name in wrapped_bitboard_generators:
+                setattr(gs.bitboards, name, self.timed_generator(name, fn))
+            else:
+                setattr(gs.bitboards, name, self.timed("bitboards." + name, fn))
+
+    def detach(self, gs):
+        gs, move_functions = self.attached.pop(id(gs))
+        for name in wrapped_methods + ["set_position"] + [fn.__name__ for fn in move_functions.values()]:
+            gs.__dict__.pop(name, None)
+        for name in wrapped_bitboard_methods + wrapped_bitboard_generators:
+            gs.bitboards.__dict__.pop(name, None)
+        gs.move_functions.clear()
+        gs.move_functions.update(move_functions)
+
+    def enable(self): #counts Move objects, this one is class wide so only while enabled
+        if self.move_patch is not None:
+            return
+        move = ChessEngine.Move
+        original_init = move.__init__
+        original_from_code = move.__dict__["from_code"]
+        profiler = self
+        def counted_init(self, start, end, board, promotion="Q"):
+            profiler.count_allocation()
+            original_init(self, start, end, board, promotion)
+        def counted_from_code(cls, code, board):
+            profiler.count_allocation()
+            return original_from_code.__func__(cls, code, board)
+        move.__init__ = counted_init
+        move.from_code = classmethod(counted_from_code)
+        self.move_patch = (original_init, original_from_code)
+
+    def disable(self):
+        for gs, move_functions in list(self.attached.values()):
+            self.detach(gs)
+        if self.move_patch is not None:
+            ChessEngine.Move.__init__, ChessEngine.Move.from_code = self.move_patch
+            self.move_patch = None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    def count_allocation(self):
+        self.allocations[";".join(frame[0] for frame in self.stack) or "<top>"] += 1
+
+    #results
+
+    def report(self):
+        nodes = self.calls["get_valid_move_codes"]
+        functions = {}
+        for name in sorted(self.calls, key=lambda n: -self.total[n]):
+            functions[name] = {"calls": self.calls[name], "total_ms": round(self.total[name] * 1000, 3),
+                               "self_ms": round(self.self_time[name] * 1000, 3),
+                               "us_per_call": round(self.total[name] / self.calls[name] * 1e6, 3)}
+        allocations = sum(self.allocations.values())
+        in_get_valid_move = sum(n for stack, n in self.allocations.items() if "get_valid_move" in stack.split(";"))
+        return {"nodes": nodes, "functions": functions,
+                "moves_generated": dict(self.generated),
+                "moves_rejected_by_check_filter": self.rejected,
+                "move_allocations": allocations,
+                "move_allocations_per_get_valid_move": round(in_get_valid_move / self.calls["get_valid_move"], 3)
+                if self.calls["get_valid_move"] else None,
+                "attack_info_per_node": round(self.calls["bitboards.attack_info"] / nodes, 3) if nodes else None,
+                "check_pin_check_per_node": round(self.calls["check_pin_check"] / nodes, 3) if nodes else None,
+                "position_types": {kind: {"nodes": n, "us_per_node": round(s / n * 1e6, 3)}
+                                   for kind, (n, s) in sorted(self.node_types.items())},
+                "slowest_nodes": [{"us": round(s * 1e6, 3), "fen": fen, "type": kind}
+                                  for s, fen, kind in sorted(self.slowest, reverse=True)]}
+
+    def collapsed(self): #flamegraph.pl / speedscope input, one "stack value" line per stack, value in microseconds
+        lines = []
+        for stack, seconds in sorted(self.stacks.items()):
+            micros = int(round(seconds * 1e6))
+            if micros > 0:
+                lines.append("%s %d" % (stack, micros))
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def write_collapsed(self, path):
+        with open(path, "w") as f:
+            f.write(self.collapsed())
+
+def position_type(gs):
+    #coarse bucket for attributing slow nodes: check state + game phase by the number of pieces on the board
+    info = gs.attack_info
+    if info is not None and info.in_check:
+        kind = "double_check" if info.check_mask == 0 else "check"
+    else:
+        kind = "quiet"
+    pieces = bin(gs.bitboards.occupied).count("1")
+    phase = "opening" if pieces > 28 else "middlegame" if pieces > 12 else "endgame"
+    return phase + "/" + kind
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="perft under the profiler")
+    parser.add_argument("--fen", default=ChessEngine.start_fen)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--backend", default="board", choices=["board", "bitboard"])
+    parser.add_argument("--json", default=None, help="write the report here instead of stdout")
+    parser.add_argument("--collapsed", default=None, help="write collapsed stacks for flamegraph.pl here")
+    args = parser.parse_args(argv)
+    gs = Perft.load_position(args.fen, args.backend)
+    with Profiler() as profiler:
+        profiler.attach(gs)
+        t = time.perf_counter()
+        profiler.enter("perft")
+        nodes = Perft.divide(gs, args.depth)
+        profiler.leave()
+        seconds = time.perf_counter() - t
+    report = profiler.report()
+    report["perft"] = {"fen": args.fen, "depth": args.depth, "backend": args.backend,
+                       "nodes": sum(nodes.values()), "seconds": round(seconds, 6)}
+    if args.collapsed:
+        profiler.write_collapsed(args.collapsed)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,356 @@
+"""
+self-play tournament: two engine settings play each other headless, many games at once over a pool of
+worker processes (one game per task, GameState and ChessAI.Searcher driven directly, no ChessMain)
+every opening is played twice with the colors swapped, the openings are random plies from the start
+position or the fens of an opening file. both sides have a clock (base + increment per move), running
+out of it loses the game. finished games are written as pgn with Move.get_notation
+
+the report has the result from the first engine's point of view: wins/draws/losses, the elo difference with
+a 95% confidence interval (positive = the first engine is stronger), the likelihood of superiority, games/hour
+and per engine nodes per move, depth and nps
+
+engine specs are "name:option=value,...", options: depth (max depth), tt (transposition table slots),
+book (OpeningBook file), tables (EndgameTable directory)
+
+usage:
+    python Tournament.py --engine base:depth=3 --engine new:depth=4 --games 40 --tc 10+0.1 --pgn games.pgn
+    python Tournament.py --engine base --engine new:book=book.bin --openings openings.fen --workers 8
+"""
+
+import argparse
+import concurrent.futures
+import json
+import math
+import os
+import random
+import sys
+import time
+
+import ChessAI
+import ChessEngine
+import PGN
+
+engine_defaults = {"depth": 64, "tt": 1 << 16, "book": None, "tables": None}
+int_options = ("depth", "tt")
+moves_to_go = 30 #the clock is spread over this many moves, plus most of the increment
+result_points = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5} #for white
+
+def parse_engine(text): #"name:depth=4,tt=65536" -> spec dict
+    name, _, options = text.partition(":")
+    if not name:
+        raise ValueError("engine without name: " + repr(text))
+    spec = dict(engine_defaults)
+    spec["name"] = name
+    for item in options.split(","):
+        if not item:
+            continue
+        key, _, value = item.partition("=")
+        if key not in engine_defaults:
+            raise ValueError("unknown engine option " + repr(key))
+        spec[key] = int(value) if key in int_options else value
+    return spec
+
+def parse_time_control(text): #"60+0.5" -> (60.0, 0.5) seconds
+    base, _, increment = text.partition("+")
+    return float(base), float(increment or 0)
+
+def insufficient_material(board): #no side can ever mate: bare kings, one minor piece, or bishops on one square color
+    minors = []
+    for r in range(8):
+        for c in range(8):
+            piece = board[r][c]
+            if piece == "--" or piece[1] == "K":
+                continue
+            if piece[1] not in "NB":
+                return False
+            minors.append((piece[1], (r + c) & 1))
+    if len(minors) <= 1:
+        return True
+    return all(kind == "B" and color == minors[0][1] for kind, color in minors)
+
+def random_opening(plies, rng, backend="board"): #e2e4 style names of plies random legal moves, none of them ends the game
+    while True:
+        gs = ChessEngine.GameState(backend)
+        names = []
+        for i in range(plies):
+            moves = gs.get_valid_move()
+            if not moves:
+                break
+            move = rng.choice(sorted(moves, key=lambda m: m.move_ID))
+            gs.make_move(move)
+            names.append(move.get_uci())
+        if len(names) == plies and gs.get_valid_move():
+            return names
+
+def make_openings(count, openings_path=None, plies=4, seed=0, backend="board"):
+    #count (fen, [e2e4 style moves]) starting points, from the opening file in order (wrapping around) or random
+    if openings_path:
+        with open(openings_path, "r") as f:
+            fens = list(PGN.read_fens(f))
+        if not fens:
+            raise ValueError("no positions in " + openings_path)
+        return [(fens[i % len(fens)], []) for i in range(count)]
+    return [(ChessEngine.start_fen, random_opening(plies, random.Random(seed * 100003 + i), backend)) for i in range(count)]
+
+#worker side, every process keeps the opened books and tables, searchers are new for every game
+
+worker_resources = {}
+
+def make_searcher(spec):
+    book = endgame = None
+    if spec["book"]:
+        key = ("book", spec["book"])
+        if key not in worker_resources:
+            import OpeningBook #optional, only loaded by engines that use a book
+            worker_resources[key] = OpeningBook.OpeningBook(spec["book"])
+        book = worker_resources[key]
+    if spec["tables"]:
+        key = ("tables", spec["tables"])
+        if key not in worker_resources:
+            import EndgameTable
+            worker_resources[key] = EndgameTable.EndgameTables(spec["tables"])
+        endgame = worker_resources[key]
+    return ChessAI.Searcher(spec["tt"], book, endgame)
+
+def move_budget(clock, increment): #seconds for the next search, never more than half of what is left
+    return max(0.0, min(clock / moves_to_go + increment * 0.75, clock * 0.5))
+
+def play_game(task):
+    #one whole game, task is the dict built by Tournament.tasks, returns the game record (a plain dict)
+    start = time.perf_counter()
+    gs = ChessEngine.GameState(task["backend"])
+    gs.set_fen(task["fen"])
+    fullmove = ChessEngine.parse_fen(task["fen"])[5]
+    legal = gs.get_valid_move()
+    san = []
+    for name in task["opening"]:
+        move = next(m for m in legal if m.get_uci() == name)
+        gs.make_move(move)
+        next_legal = gs.get_valid_move()
+        san.append(move.get_notation(gs, legal))
+        legal = next_legal
+    specs = {"w": task["white"], "b": task["black"]}
+    searchers = {color: make_searcher(spec) for color, spec in specs.items()}
+    clocks = {"w": task["time_control"][0], "b": task["time_control"][0]}
+    increment = task["time_control"][1]
+    stats = {color: {"moves": 0, "book_moves": 0, "nodes": 0, "depth": 0, "seconds": 0.0} for color in "wb"}
+    result = None
+    while True:
+        if gs.checkmate:
+            result, termination = ("0-1" if gs.white_to_move else "1-0"), "checkmate"
+        elif gs.stalemate:
+            result, termination = "1/2-1/2", "stalemate"
+        elif gs.get_draw():
+            result, termination = "1/2-1/2", gs.get_draw()
+        elif insufficient_material(gs.board):
+            result, termination = "1/2-1/2", "insufficient material"
+        elif len(san) >= task["max_plies"]:
+            result, termination = "1/2-1/2", "adjudication"
+        if result is not None:
+            break
+        color = "w" if gs.white_to_move else "b"
+        t = time.perf_counter()
+        found = searchers[color].search(gs, move_budget(clocks[color], increment), specs[color]["depth"])
+        used = time.perf_counter() - t
+        clocks[color] -= used
+        if clocks[color] < 0:
+            other = "b" if color == "w" else "w"
+            #running out of time only loses when the other side could still mate
+            if insufficient_material([[p if p[0] == other else "--" for p in row] for row in gs.board]):
+                result = "1/2-1/2"
+            else:
+                result = "0-1" if color == "w" else "1-0"
+            termination = "time forfeit"
+            break
+        clocks[color] += increment
+        stat = stats[color]
+        stat["seconds"] += used
+        if found.nodes:
+            stat["moves"] += 1
+            stat["nodes"] += found.nodes
+            stat["depth"] += found.depth
+        else: #book or endgame table
+            stat["book_moves"] += 1
+        move = next(m for m in legal if m.move_ID == found.move.move_ID)
+        gs.make_move(move)
+        next_legal = gs.get_valid_move()
+        san.append(move.get_notation(gs, legal))
+        legal = next_legal
+    return {"index": task["index"], "round": task["round"], "white": specs["w"]["name"], "black": specs["b"]["name"],
+            "fen": task["fen"], "fullmove": fullmove, "moves": san, "result": result, "termination": termination,
+            "time_control": task["time_control"], "stats": stats, "seconds": time.perf_counter() - start}
+
+#results
+
+def score_to_elo(score): #expected score -> elo difference, None at 0% and 100%
+    if score <= 0 or score >= 1:
+        return None
+    return -400 * math.log10(1 / score - 1)
+
+def elo_report(wins, draws, losses):
+    #elo difference with a 95% interval from the standard error of the per game score (trinomial)
+    games = wins + draws + losses
+    if games == 0:
+        return {"elo": None, "elo_low": None, "elo_high": None, "los": None}
+    score = (wins + 0.5 * draws) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    los = 0.5 * (1 + math.erf((wins - losses) / math.sqrt(2 * (wins + losses)))) if wins + losses else 0.5
+    low = score_to_elo(score - margin)
+    high = score_to_elo(score + margin)
+    elo = score_to_elo(score)
+    return {"score": round(score, 4), "elo": round(elo, 1) if elo is not None else None,
+            "elo_low": round(low, 1) if low is not None else None,
+            "elo_high": round(high, 1) if high is not None else None, "los": round(los, 4)}
+
+def game_to_pgn(game, event="self-play"):
+    base, increment = game["time_control"]
+    tags = [("Event", event), ("Site", "?"), ("Date", time.strftime("%Y.%m.%d")), ("Round", str(game["round"])),
+            ("White", game["white"]), ("Black", game["black"]), ("Result", game["result"]),
+            ("TimeControl", "%g+%g" % (base, increment)), ("Termination", game["termination"]),
+            ("PlyCount", str(len(game["moves"])))]
+    if game["fen"] != ChessEngine.start_fen:
+        tags += [("SetUp", "1"), ("FEN", game["fen"])]
+    tokens = []
+    number = game["fullmove"]
+    white_to_move = game["fen"].split()[1] == "w"
+    for i, san in enumerate(game["moves"]):
+        if white_to_move:
+            tokens.append("%d." % number)
+        elif i == 0:
+            tokens.append("%d..." % number)
+        tokens.append(san)
+        if not white_to_move:
+            number += 1
+        white_to_move = not white_to_move
+    tokens.append(game["result"])
+    lines = []
+    line = ""
+    for token in tokens: #movetext lines of at most 80 characters
+        if line and len(line) + 1 + len(token) > 80:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return "".join('[%s "%s"]\n' % tag for tag in tags) + "\n" + "\n".join(lines) + "\n\n"
+
+class Tournament():
+    #engines is a list of 2 specs from parse_engine, results are from the point of view of engines[0]
+    def __init__(self, engines, games=20, time_control=(10.0, 0.1), workers=None, openings_path=None,
+                 opening_plies=4, max_plies=400, seed=0, backend="board"):
+        if len(engines) != 2:
+            raise ValueError("a tournament needs 2 engines, got %d" % len(engines))
+        if engines[0]["name"] == engines[1]["name"]:
+            raise ValueError("both engines are called " + engines[0]["name"])
+        self.engines = engines
+        self.games = games + games % 2 #every opening with both colors
+        self.time_control = time_control
+        self.workers = workers or os.cpu_count() or 1
+        self.openings_path = openings_path
+        self.opening_plies = opening_plies
+        self.max_plies = max_plies
+        self.seed = seed
+        self.backend = backend
+
+    def tasks(self):
+        openings = make_openings(self.games // 2, self.openings_path, self.opening_plies, self.seed, self.backend)
+        tasks = []
+        for i in range(self.games):
+            fen, moves = openings[i // 2]
+            white, black = self.engines if i % 2 == 0 else self.engines[::-1]
+            tasks.append({"index": i, "round": i + 1, "fen": fen, "opening": moves, "white": white, "black": black,
+                          "time_control": self.time_control, "max_plies": self.max_plies, "backend": self.backend})
+        return tasks
+
+    def run(self, pgn_path=None):
+        #plays every game, writes them to pgn_path as they finish (finish order), returns the report
+        start = time.perf_counter()
+        tasks = self.tasks()
+        records = []
+        pgn = open(pgn_path, "w") if pgn_path else None
+        try:
+            if self.workers == 1: #in process, easier to profile and debug
+                finished = (play_game(task) for task in tasks)
+                pool = None
+            else:
+                pool = concurrent.futures.ProcessPoolExecutor(max_workers=min(self.workers, len(tasks)))
+                futures = [pool.submit(play_game, task) for task in tasks]
+                finished = (future.result() for future in concurrent.futures.as_completed(futures))
+            for game in finished:
+                records.append(game)
+                if pgn is not None:
+                    pgn.write(game_to_pgn(game))
+                    pgn.flush()
+            if pool is not None:
+                pool.shutdown()
+        finally:
+            if pgn is not None:
+                pgn.close()
+        records.sort(key=lambda game: game["index"])
+        return self.report(records, time.perf_counter() - start)
+
+    def report(self, records, seconds):
+        first = self.engines[0]["name"]
+        wins = draws = losses = 0
+        terminations = {}
+        engines = {spec["name"]: {"moves": 0, "book_moves": 0, "nodes": 0, "depth": 0, "seconds": 0.0}
+                   for spec in self.engines}
+        for game in records:
+            points = result_points[game["result"]]
+            if game["black"] == first:
+                points = 1 - points
+            if points == 1:
+                wins += 1
+            elif points == 0:
+                losses += 1
+            else:
+                draws += 1
+            terminations[game["termination"]] = terminations.get(game["termination"], 0) + 1
+            for color, name in (("w", game["white"]), ("b", game["black"])):
+                for key, value in game["stats"][color].items():
+                    engines[name][key] += value
+        for name, stat in engines.items():
+            moves = stat["moves"]
+            stat["nodes_per_move"] = round(stat["nodes"] / moves, 1) if moves else None
+            stat["average_depth"] = round(stat.pop("depth") / moves, 2) if moves else None
+            stat["nps"] = int(stat["nodes"] / stat["seconds"]) if stat["seconds"] > 0 else None
+            stat["seconds"] = round(stat["seconds"], 3)
+        report = {"engines": [spec["name"] for spec in self.engines], "games": len(records),
+                  "wins": wins, "draws": draws, "losses": losses}
+        report.update(elo_report(wins, draws, losses))
+        plies = sum(len(game["moves"]) for game in records)
+        report.update({"terminations": terminations, "time_control": "%g+%g" % self.time_control,
+                       "workers": self.workers, "seconds": round(seconds, 3),
+                       "games_per_hour": round(len(records) / seconds * 3600, 1) if seconds > 0 else None,
+                       "average_plies": round(plies / len(records), 1) if records else None,
+                       "per_engine": engines})
+        return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="engine vs engine games in parallel, results with elo")
+    parser.add_argument("--engine", action="append", default=None,
+                        help="name:option=value,... (depth, tt, book, tables), give it twice")
+    parser.add_argument("--games", type=int, default=20, help="rounded up to an even number")
+    parser.add_argument("--tc", default="10+0.1", help="seconds per game + increment per move")
+    parser.add_argument("--workers", type=int, default=None, help="default: one per cpu")
+    parser.add_argument("--openings", default=None, help="one fen per line, default: random plies from the start")
+    parser.add_argument("--opening-plies", type=int, default=4, help="random plies when there is no --openings")
+    parser.add_argument("--max-plies", type=int, default=400, help="draw after this many plies")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", default="board", choices=["board", "bitboard"])
+    parser.add_argument("--pgn", default=None, help="write the games here")
+    args = parser.parse_args(argv)
+    try:
+        engines = [parse_engine(text) for text in (args.engine or ["a", "b"])]
+        tournament = Tournament(engines, args.games, parse_time_control(args.tc), args.workers, args.openings,
+                                args.opening_plies, args.max_plies, args.seed, args.backend)
+    except ValueError as e:
+        parser.error(str(e))
+    report = tournament.run(args.pgn)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
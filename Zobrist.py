@@ -0,0 +1,78 @@
+"""
+zobrist hashing: the key of a position is the xor of one random 64 bit number for every
+(piece, square) pair on the board, plus one more number when black is to move,
+one for the castling rights and one for the file of the en passant square
+GameState keeps the key up to date in make_move/undo_move by xoring only what changed
+"""
+
+import random
+
+import Bitboard
+
+pieces = ["wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK"]
+#the keys are made by init_keys on the first compute_hash (every GameState starts with one), not at import
+#the containers are filled in place, so Zobrist.castling_keys etc. can be read from other modules
+piece_keys = {} #piece -> 64 keys indexed by row*8 + col
+black_to_move = 0
+#indexed by the castling rights (0-15), no rights is 0 so positions without castling keep their old key
+castling_keys = []
+en_passant_keys = [] #indexed by the col of the en passant square
+
+def init_keys():
+    #fixed seed so the keys (and so every stored hash) are the same in every process and every run
+    #the order of the draws must not change, opening books store these keys
+    global black_to_move
+    if piece_keys:
+        return
+    rng = random.Random(0x5EED)
+    keys = {piece: [rng.getrandbits(64) for sq in range(64)] for piece in pieces}
+    black_to_move = rng.getrandbits(64)
+    castling_keys.extend([0] + [rng.getrandbits(64) for rights in range(1, 16)])
+    en_passant_keys.extend(rng.getrandbits(64) for col in range(8))
+    piece_keys.update(keys) #last, piece_keys being filled is the ready flag
+
+def compute_hash(board, white_to_move, castling=0, en_passant=Bitboard.no_en_passant):
+    #full recompute from scratch, 64 square scan
+    if not piece_keys:
+        init_keys()
+    key = 0
+    for r in range(8):
+        for c in range(8):
+            piece = board[r][c]
+            if piece != "--":
+                key ^= piece_keys[piece][r*8 + c]
+    if not white_to_move:
+        key ^= black_to_move
+    key ^= castling_keys[castling]
+    if en_passant != Bitboard.no_en_passant:
+        key ^= en_passant_keys[en_passant & 7]
+    return key
+
+def move_delta(move): #what the pieces of move change in the key, castling rights and en passant are up to GameState
+    start = move.start_row*8 + move.start_col
+    end = move.end_row*8 + move.end_col
+    if move.move_ID >> 12:
+        return special_move_delta(move, start, end)
+    keys = piece_keys[move.piece_moved]
+    delta = keys[start] ^ keys[end] ^ black_to_move
+    if move.piece_capt != "--":
+        delta ^= piece_keys[move.piece_capt][end]
+    return delta
+
+def special_move_delta(move, start, end): #promotion, en passant and castling
+    moved = move.piece_moved
+    flag = move.move_ID >> 12
+    if flag & Bitboard.flag_promotion:
+        delta = piece_keys[moved][start] ^ piece_keys[moved[0] + Bitboard.promotion_pieces[flag & 3]][end] ^ black_to_move
+    else:
+        keys = piece_keys[moved]
+        delta = keys[start] ^ keys[end] ^ black_to_move
+    if move.piece_capt != "--":
+        if flag == Bitboard.flag_en_passant:
+            end = move.start_row*8 + move.end_col
+        delta ^= piece_keys[move.piece_capt][end]
+    elif flag == Bitboard.flag_castle:
+        rook_start, rook_end = Bitboard.castle_rooks[end]
+        keys = piece_keys[moved[0] + "R"]
+        delta ^= keys[rook_start] ^ keys[rook_end]
+    return delta